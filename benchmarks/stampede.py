@@ -0,0 +1,122 @@
+"""Simulates the exam-start rush on the public seat pages.
+
+Run with `python -m benchmarks.stampede URL FIRST_SEAT LAST_SEAT
+[--students 400] [--concurrency 200] [--revisits 2] [--output results.json]`
+against a running server, e.g. `flask run` or gunicorn with an exam
+loaded by `python -m benchmarks.suite` into a shared DATABASE_URL.
+
+Each simulated student opens a new connection and requests
+/seat/<id>/ for a random seat in [FIRST_SEAT, LAST_SEAT], then reloads it
+REVISITS more times with the ETag it was given, like a phone refreshing
+in a queue. Reports throughput and latency percentiles as JSON.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, status, seconds):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(seconds)
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)] if ordered else None
+
+
+async def fetch(host, port, path, etag=None):
+    """Makes one GET on a fresh connection. Returns (status, etag)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = ['GET {} HTTP/1.1'.format(path), 'Host: {}'.format(host), 'Connection: close']
+        if etag:
+            lines.append('If-None-Match: {}'.format(etag))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        status = int((await reader.readline()).split()[1])
+        etag = None
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'etag':
+                etag = value.strip()
+        await reader.read()
+        return status, etag
+    finally:
+        writer.close()
+
+
+async def student(url, seat_id, revisits, limit, stats):
+    path = '{}/seat/{}/'.format(url.path.rstrip('/'), seat_id)
+    etag = None
+    for _ in range(revisits + 1):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                status, etag = await fetch(url.hostname, url.port or 80, path, etag)
+            except (OSError, ValueError, IndexError):
+                stats.errors += 1
+                return
+            stats.record(status, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('url')
+    parser.add_argument('first_seat', type=int)
+    parser.add_argument('last_seat', type=int)
+    parser.add_argument('--students', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--revisits', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    url = urllib.parse.urlsplit(args.url)
+    rng = random.Random(args.seed)
+    stats = Stats()
+    loop = asyncio.get_event_loop()
+    limit = asyncio.Semaphore(args.concurrency)
+    tasks = [
+        student(url, rng.randint(args.first_seat, args.last_seat), args.revisits, limit, stats)
+        for _ in range(args.students)
+    ]
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*tasks))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        'url': args.url,
+        'students': args.students,
+        'concurrency': args.concurrency,
+        'requests': len(stats.latencies),
+        'errors': stats.errors,
+        'statuses': stats.statuses,
+        'seconds': elapsed,
+        'requests_per_second': len(stats.latencies) / elapsed,
+        'latency': {
+            'p50': stats.percentile(0.5),
+            'p90': stats.percentile(0.9),
+            'p99': stats.percentile(0.99),
+            'max': stats.percentile(1),
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
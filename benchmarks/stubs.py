@@ -0,0 +1,80 @@
+"""Local stand-ins for the auth server, its sheets proxy and SendGrid.
+
+Each stub is a threaded HTTP server on a free port, so benchmarks exercise
+the app's real HTTP clients without leaving the machine.
+"""
+import http.server
+import json
+import socketserver
+import threading
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode() or 'null')
+
+    def reply(self, status, value=None):
+        data = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start(handler):
+    server = Server(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def auth_server(offering, sheets):
+    """Starts a stub auth server for OFFERING whose sheets proxy serves
+    SHEETS, a dict from sheet name to values. Returns its base URL."""
+    class AuthHandler(Handler):
+        def do_POST(self):
+            body = self.read_json()
+            if self.path == '/domains/get_course':
+                self.reply(200, offering.split('/')[1])
+            elif self.path.endswith('/get_endpoint'):
+                self.reply(200, offering)
+            elif self.path == '/admins/is_admin':
+                self.reply(200, True)
+            elif self.path == '/google/read_spreadsheet':
+                self.reply(200, sheets.get(body['sheet_name'], []))
+            else:
+                self.reply(404)
+
+    return start(AuthHandler)[1]
+
+
+class SendGrid:
+    """A stub SendGrid that accepts every mail send and counts recipients."""
+
+    def __init__(self):
+        self.requests = 0
+        self.recipients = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class SendGridHandler(Handler):
+            def do_POST(self):
+                body = self.read_json()
+                with stub.lock:
+                    stub.requests += 1
+                    stub.recipients += len(body['personalizations'])
+                self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server, self.url = start(SendGridHandler)
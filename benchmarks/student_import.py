@@ -0,0 +1,79 @@
+"""Compares the bulk student import with the old row-at-a-time path.
+
+Run with `python -m benchmarks.student_import [students]`. Always uses an
+in-memory SQLite database, since it drops every table when it is done.
+"""
+import os
+import random
+import sys
+import time
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from server import app
+from server.bulk import StudentRow, upsert_students
+from server.models import Exam, Student, db
+
+ATTRIBUTES = ['lefty', 'front', 'back', 'aisle', 'broken']
+
+
+def roster(n, rng):
+    return [
+        StudentRow(
+            'student{}@berkeley.edu'.format(i),
+            'Student, Number{}'.format(i),
+            str(3030000000 + i),
+            str(100000 + i),
+            {a for a in ATTRIBUTES if rng.random() < 0.05},
+            {a for a in ATTRIBUTES if rng.random() < 0.05},
+        )
+        for i in range(n)
+    ]
+
+
+def row_at_a_time(exam, rows):
+    """The import as it was before server.bulk: one SELECT per row."""
+    students = []
+    for row in rows:
+        student = Student.query.filter_by(exam_id=exam.id, email=row.email).first()
+        if not student:
+            student = Student(exam_id=exam.id, email=row.email)
+        student.name = row.name
+        student.sid = row.sid or student.sid
+        student.bcourses_id = row.bcourses_id or student.bcourses_id
+        student.wants = row.wants
+        student.avoids = row.avoids
+        students.append(student)
+    db.session.add_all(students)
+    db.session.commit()
+
+
+def run(name, fn, exam, rows):
+    start = time.time()
+    fn(exam, rows)
+    elapsed = time.time() - start
+    print('{:<20} {:>6} rows {:>8.3f}s {:>10.0f} rows/s'.format(name, len(rows), elapsed, len(rows) / elapsed))
+    return elapsed
+
+
+def main(n=2000):
+    rng = random.Random(0)
+    rows = roster(n, rng)
+    # Change a tenth of the roster for the re-import
+    changed = [row._replace(name=row.name + ' Jr.') if i % 10 == 0 else row for i, row in enumerate(rows)]
+    with app.app_context():
+        if str(db.engine.url) != 'sqlite://':
+            # e.g. FLASK_ENV=development, which points at the local app.db
+            sys.exit('Refusing to run against {}; unset FLASK_ENV'.format(db.engine.url))
+        db.create_all()
+        for label, fn in (('row-at-a-time', row_at_a_time), ('bulk', upsert_students)):
+            exam = Exam(offering='bench/bench/bench', name=label, display_name=label, is_active=False)
+            db.session.add(exam)
+            db.session.commit()
+            run(label + ' new', fn, exam, rows)
+            run(label + ' again', fn, exam, changed)
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,205 @@
+"""Times the app's hot paths on synthetic exams and records the results.
+
+Run with `python -m benchmarks.suite [--students 500 1000 5000]
+[--output results.json] [--compare previous.json]`. Uses an in-memory
+SQLite database unless DATABASE_URL is set (e.g. to a scratch local MySQL
+database, which is left holding the benchmark exams), and
+stub auth, sheets and SendGrid servers in place of the real services.
+
+For each roster size, a fresh exam goes through room import, student
+import, both assignment modes, the roster, room and public seat pages,
+and building and sending the seat emails. Every step is timed, and the
+results are written as JSON so runs can be compared over time.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from server import app, bulk, emails
+from server.models import Exam, SeatAssignment, Student, User, db
+from server.views import (MASTER_ROOM_SHEET, assign_students, new_exam_room, parse_seats, parse_students,
+                          read_csv, read_csvs)
+
+from benchmarks import stubs, synthetic
+
+OFFERING = 'bench/cs61a/sp20'
+
+MESSAGE = {
+    'from': 'cs61a@berkeley.edu',
+    'subject': 'Your seat for the benchmark',
+    'additional_text': 'Good luck!',
+}
+
+
+class Timer:
+    """Collects the wall-clock time of each named step."""
+
+    def __init__(self):
+        self.results = {}
+
+    def time(self, name, fn, repeat=1):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = fn()
+            seconds.append(time.perf_counter() - start)
+        self.results[name] = {'seconds': seconds, 'best': min(seconds)}
+        print('  {:<24} {:>9.4f}s'.format(name, min(seconds)))
+        return value
+
+
+def login(user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+def get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    return response
+
+
+def import_rooms(exam, sheets):
+    # What the import_rooms job does, minus its progress reports
+    for (_, display_name), future in read_csvs([(MASTER_ROOM_SHEET, name) for name in sheets]):
+        room = new_exam_room(exam, display_name)
+        headers, rows = future.result()
+        bulk.insert_rooms([(room, parse_seats(headers, rows))])
+
+
+def import_students(exam):
+    headers, rows = read_csv('roster', 'roster')
+    return bulk.upsert_students(exam, parse_students(headers, rows))
+
+
+def assign(exam, mode):
+    assignments = assign_students(exam, seed=0, mode=mode)
+    assert not isinstance(assignments, str), assignments
+    return assignments
+
+
+def save(assignments):
+    db.session.add_all(assignments)
+    db.session.commit()
+
+
+def run(students, sheets, client, rng):
+    timer = Timer()
+    name = 'exam{}-{}'.format(students, int(time.time()))
+    exam = Exam(offering=OFFERING, name=name, display_name='Exam', is_active=True)
+    db.session.add(exam)
+    db.session.commit()
+
+    rooms = synthetic.rooms_for(students)
+    sheets.clear()
+    sheets.update(rooms)
+    sheets['roster'] = synthetic.roster_sheet(students, rng)
+    timer.time('room import', lambda: import_rooms(exam, rooms))
+    timer.time('student import', lambda: import_students(exam))
+    timer.time('student re-import', lambda: import_students(exam))
+
+    timer.time('assign greedy', lambda: assign(exam, 'greedy'), repeat=3)
+    assignments = timer.time('assign matching', lambda: assign(exam, 'matching'), repeat=3)
+    timer.time('save assignments', lambda: save(assignments))
+
+    base = '/{}/{}/'.format(OFFERING, exam.name)
+    room = max(exam.rooms, key=lambda r: len(r.seats))
+    seat = room.seats[len(room.seats) // 2]
+    timer.time('roster render', lambda: get(client, base + 'students/'), repeat=3)
+    timer.time('room render cold', lambda: get(client, base + 'rooms/{}/'.format(room.name)))
+    timer.time('room render', lambda: get(client, base + 'rooms/{}/'.format(room.name)), repeat=3)
+    public = app.test_client()
+    timer.time('seat render cold', lambda: get(public, '/seat/{}/'.format(seat.id)))
+    timer.time('seat render', lambda: get(public, '/seat/{}/'.format(seat.id)), repeat=3)
+
+    timer.time('email payloads', lambda: list(emails.batches(emails.pending_assignments(exam))), repeat=3)
+    timer.time('email send', lambda: emails.email_students(exam, MESSAGE, 'http://localhost/'))
+    return {
+        'students': students,
+        'rooms': len(rooms),
+        'seats': sum(len(r.seats) for r in exam.rooms),
+        'assigned': SeatAssignment.query.join(SeatAssignment.student).filter(Student.exam_id == exam.id).count(),
+        'results': timer.results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(runs, previous):
+    """Prints each step's best time as a ratio of the same step in PREVIOUS."""
+    before = {run['students']: run['results'] for run in previous['runs']}
+    for run in runs:
+        old = before.get(run['students'])
+        if not old:
+            continue
+        print('{} students vs {}:'.format(run['students'], previous.get('commit') or 'previous run'))
+        for name, result in run['results'].items():
+            if name in old:
+                print('  {:<24} {:>7.2f}x'.format(name, result['best'] / old[name]['best']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--students', type=int, nargs='+', default=[500, 1000, 5000])
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous results file to compare against')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sheets = {}
+    sendgrid = stubs.SendGrid()
+    app.config.update(
+        AUTH_SERVER=stubs.auth_server(OFFERING, sheets),
+        SENDGRID_HOST=sendgrid.url,
+        SENDGRID_API_KEY='benchmark',
+        JOB_WORKERS=0,
+    )
+    app.config['SHEETS_URL'] = app.config['AUTH_SERVER'] + '/google/read_spreadsheet'
+
+    started_at = datetime.datetime.utcnow()
+    rng = random.Random(args.seed)
+    runs = []
+    with app.app_context():
+        db.create_all()
+        user = User(email='bench@berkeley.edu', offerings={OFFERING})
+        db.session.add(user)
+        db.session.commit()
+        client = login(user)
+        for students in args.students:
+            print('{} students'.format(students))
+            runs.append(run(students, sheets, client, rng))
+
+    report = {
+        'started_at': started_at.isoformat() + 'Z',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': db.engine.dialect.name,
+        'seed': args.seed,
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(runs, json.load(f))
+    return report
+
+
+if __name__ == '__main__':
+    main()
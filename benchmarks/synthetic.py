@@ -0,0 +1,79 @@
+"""Synthetic rooms and rosters shaped like the real Google Sheets.
+
+Rooms are lecture halls with lettered rows, a left-handed seat every few
+seats, aisle seats at both ends of each row and a few front rows. Students
+mostly have no preference; a few want or avoid an attribute. Both are
+returned as sheet values (a header row followed by rows) so they
+go through the same parsing as an import.
+"""
+import string
+
+ROOM_SHAPES = [
+    # (display name, rows, seats per row)
+    ('Wheeler 150', 26, 30),
+    ('Dwinelle 155', 20, 24),
+    ('Pimentel 1', 24, 28),
+    ('VLSB 2050', 18, 26),
+    ('Li Ka Shing 245', 16, 22),
+    ('Evans 10', 14, 20),
+]
+
+PREFERENCES = [
+    # (attribute, fraction who want it, fraction who avoid it)
+    ('lefty', 0.08, 0),
+    ('front', 0.03, 0),
+    ('aisle', 0.02, 0.01),
+]
+
+
+def row_name(i):
+    letters = string.ascii_uppercase
+    return letters[i] if i < len(letters) else letters[i // len(letters) - 1] + letters[i % len(letters)]
+
+
+def room_sheet(rows, seats_per_row):
+    values = [['Row', 'Seat', 'lefty', 'aisle', 'front']]
+    for r in range(rows):
+        for s in range(seats_per_row):
+            values.append([
+                row_name(r),
+                str(s + 1),
+                'TRUE' if s % 6 == 1 else '',
+                'TRUE' if s in (0, seats_per_row - 1) else '',
+                'TRUE' if r < 3 else '',
+            ])
+    return values
+
+
+def rooms_for(students, headroom=1.25):
+    """Returns {display name: sheet values} for enough rooms to seat STUDENTS."""
+    sheets = {}
+    capacity = 0
+    copy = 0
+    while capacity < students * headroom:
+        for name, rows, seats_per_row in ROOM_SHAPES:
+            if capacity >= students * headroom:
+                break
+            if copy:
+                name = '{} ({})'.format(name, copy + 1)
+            sheets[name] = room_sheet(rows, seats_per_row)
+            capacity += rows * seats_per_row
+        copy += 1
+    return sheets
+
+
+def roster_sheet(students, rng):
+    headers = ['Email', 'Name', 'Student ID', 'bCourses ID'] + [attribute for attribute, _, _ in PREFERENCES]
+    values = [headers]
+    for i in range(students):
+        row = [
+            'student{}@berkeley.edu'.format(i),
+            'Student{}, Test'.format(i),
+            str(3030000000 + i),
+            str(1000000 + i),
+        ]
+        for _, wants, avoids in PREFERENCES:
+            x = rng.random()
+            row.append('TRUE' if x < wants else 'FALSE' if x < wants + avoids else '')
+        values.append(row)
+    return values
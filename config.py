@@ -22,11 +22,68 @@ OK_CLIENT_SECRET = os.getenv('OK_CLIENT_SECRET', "kmSPJYPzKJglOOOmr7q0irMfBVMRFX
 AUTH_KEY = os.getenv("AUTH_KEY", "seating-app")
 AUTH_CLIENT_SECRET = os.getenv("AUTH_CLIENT_SECRET")
 
+# Course, endpoint and admin lookups. Results are cached per worker for
+# AUTH_CACHE_TTL seconds (failures for AUTH_CACHE_NEGATIVE_TTL), and served
+# stale for up to AUTH_CACHE_STALE more seconds while being refreshed
+AUTH_SERVER = os.getenv('AUTH_SERVER', 'https://auth.apps.cs61a.org')
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))
+AUTH_CACHE_NEGATIVE_TTL = int(os.getenv('AUTH_CACHE_NEGATIVE_TTL', 30))
+AUTH_CACHE_STALE = int(os.getenv('AUTH_CACHE_STALE', 3600))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 4096))
+# Admin checks are cached for at most this long, and never served stale
+ADMIN_CACHE_TTL = int(os.getenv('ADMIN_CACHE_TTL', 30))
+
+# Spreadsheet proxy used to read room and student sheets, and how many
+# sheets to fetch at once when importing several rooms
+SHEETS_URL = os.getenv('SHEETS_URL', AUTH_SERVER + '/google/read_spreadsheet')
+SHEET_FETCH_WORKERS = int(os.getenv('SHEET_FETCH_WORKERS', 8))
+
+# How long a worker serves its cached public seating chart for a room
+# before checking the database for changes, in seconds. This is also how
+# long other workers can keep showing a room after it is deleted.
+PUBLIC_CHART_TTL = int(os.getenv('PUBLIC_CHART_TTL', 60))
+
+# How long each worker reuses an exam looked up from a URL before reading it
+# again; changes made through this worker are seen immediately
+EXAM_CACHE_TTL = int(os.getenv('EXAM_CACHE_TTL', 30))
+
+# Background jobs: worker threads per web process, and how often idle
+# workers check the database for jobs queued by other processes
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 1))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 5))
+# Running jobs update their row this often, and are failed if they haven't
+# for JOB_TIMEOUT seconds because their process died
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 300))
+
 # Email setup. Domain environment is for link in email.
 SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
+SENDGRID_HOST = os.getenv('SENDGRID_HOST', 'https://api.sendgrid.com')
+# Batches sent at once, and how often (and how patiently) to retry a batch
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', 4))
+EMAIL_RETRIES = int(os.getenv('EMAIL_RETRIES', 3))
+EMAIL_BACKOFF = float(os.getenv('EMAIL_BACKOFF', 1))
 
 # Must be an absolute path
 PHOTO_DIRECTORY = os.getenv('PHOTO_DIRECTORY', os.path.join(BASE_DIR, "storage"))
+# Threads used to unpack an uploaded photo zip
+PHOTO_WORKERS = int(os.getenv('PHOTO_WORKERS', 4))
+# Largest width and height of the photos shown on seating charts, and how
+# long browsers may cache them
+THUMBNAIL_SIZE = (188, 250)
+PHOTO_CACHE_SECONDS = int(os.getenv('PHOTO_CACHE_SECONDS', 7 * 24 * 60 * 60))
+# Photo URLs on seating charts stop working after this many seconds
+PHOTO_URL_MAX_AGE = int(os.getenv('PHOTO_URL_MAX_AGE', 4 * 60 * 60))
+
+# Opt-in request instrumentation, served in Prometheus format at /metrics
+# to admins or to requests bearing "Authorization: Bearer METRICS_TOKEN".
+# PROFILE_SAMPLE_RATE of requests are also profiled, and each worker keeps
+# its PROFILE_KEEP slowest profiles in PROFILE_DIRECTORY
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))
+PROFILE_DIRECTORY = os.getenv('PROFILE_DIRECTORY', os.path.join(BASE_DIR, 'profiles'))
 
 TEST_LOGIN = os.getenv('TEST_LOGIN')
 
@@ -10,6 +10,10 @@ class UrlRequestContext(flask.ctx.RequestContext):
 
     def push(self):
         super().push()
+        # Started before matching so the converters' queries and auth calls
+        # are measured too
+        if self.app.instrumentation:
+            self.app.instrumentation.start(self)
         try:
             url_rule, self.request.view_args = \
                 self.url_adapter.match(return_rule=True)
@@ -17,7 +21,15 @@ class UrlRequestContext(flask.ctx.RequestContext):
         except HTTPException as e:
             self.request.routing_exception = e
 
+    def pop(self, *args):
+        if self.app.instrumentation:
+            self.app.instrumentation.finish(self)
+        super().pop(*args)
+
 class App(Flask):
+    # Set by server.metrics when METRICS_ENABLED
+    instrumentation = None
+
     def request_context(self, environ):
         return UrlRequestContext(self, environ)
 
@@ -31,5 +43,7 @@ app.jinja_env.filters.update(
 )
 
 import server.auth
+import server.cli
+import server.metrics
 import server.models
 import server.views
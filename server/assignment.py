@@ -0,0 +1,615 @@
+import collections
+import itertools
+import math
+import random
+
+
+def preference_of(student):
+    return (frozenset(student.wants), frozenset(student.avoids))
+
+
+def bits(mask):
+    """Yields the index of every set bit in MASK, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+class SeatIndex:
+    """An inverted index from seat attribute to a bitset of seats.
+
+    Seats are numbered by their position in SEATS, and bit i of every mask
+    refers to seats[i]. Masks are plain Python ints, so intersecting or
+    differencing the seats for a preference is a handful of big-int
+    operations instead of a scan over every seat's attribute set.
+    """
+
+    def __init__(self, seats):
+        self.seats = list(seats)
+        self.all = (1 << len(self.seats)) - 1
+        self.by_attribute = {}
+        for i, seat in enumerate(self.seats):
+            for attribute in seat.attributes:
+                self.by_attribute[attribute] = self.by_attribute.get(attribute, 0) | (1 << i)
+
+    def eligible(self, preference, available=None):
+        """Returns the mask of seats with every wanted and no avoided attribute."""
+        wants, avoids = preference
+        mask = self.all if available is None else available
+        for attribute in wants:
+            mask &= self.by_attribute.get(attribute, 0)
+        for attribute in avoids:
+            mask &= ~self.by_attribute.get(attribute, 0)
+        return mask
+
+
+class AssignmentFailed(Exception):
+    def __init__(self, preference):
+        super().__init__(preference)
+        self.preference = preference
+
+    def __str__(self):
+        return 'Assignment failed! No more seats for preference {}'.format(self.preference)
+
+
+class PreferenceGroup:
+    def __init__(self, preference, students, mask):
+        self.preference = preference
+        self.students = students
+        self.mask = mask
+        self.count = popcount(mask)
+        self.candidates = list(bits(mask))
+
+
+def group_students(students, index, available=None):
+    by_preference = {}
+    for student in students:
+        by_preference.setdefault(preference_of(student), []).append(student)
+    # Sort so that ties between groups break the same way on every run
+    return [
+        PreferenceGroup(preference, by_preference[preference], index.eligible(preference, available))
+        for preference in sorted(by_preference, key=lambda p: (sorted(p[0]), sorted(p[1])))
+    ]
+
+
+def assign(students, seats, rng=None):
+    """Pairs STUDENTS with SEATS, most constrained preference group first.
+
+    Repeatedly picks the preference group with the fewest seats left, seats
+    a random student of that group in a random eligible seat, and updates
+    the remaining seat count of every group that could have used that seat.
+    Returns a list of (student, seat) pairs, or raises AssignmentFailed
+    with the first preference that runs out of seats.
+    """
+    rng = rng or random.Random()
+    index = SeatIndex(seats)
+    groups = group_students(students, index)
+    taken = [False] * len(index.seats)
+    pairs = []
+    while groups:
+        group = min(groups, key=lambda g: g.count)
+        if not group.count:
+            raise AssignmentFailed(group.preference)
+
+        i = rng.randrange(len(group.students))
+        group.students[i], group.students[-1] = group.students[-1], group.students[i]
+        student = group.students.pop()
+
+        # Candidates are removed lazily, so each seat leaves each list at most once
+        candidates = group.candidates
+        while True:
+            i = rng.randrange(len(candidates))
+            seat = candidates[i]
+            candidates[i] = candidates[-1]
+            candidates.pop()
+            if not taken[seat]:
+                break
+
+        taken[seat] = True
+        bit = 1 << seat
+        for g in groups:
+            if g.mask & bit:
+                g.count -= 1
+        if not group.students:
+            groups.remove(group)
+        pairs.append((student, index.seats[seat]))
+    return pairs
+
+
+def describe(preference):
+    wants, avoids = preference
+    parts = []
+    if wants:
+        parts.append('wants ' + ', '.join(sorted(wants)).upper())
+    if avoids:
+        parts.append('avoids ' + ', '.join(sorted(avoids)).upper())
+    return '; '.join(parts) or 'no preference'
+
+
+class AssignmentInfeasible(AssignmentFailed):
+    """Raised when no complete matching exists.
+
+    SHORTAGES lists (preference, students, seats) for every preference group
+    in the over-subscribed set, where STUDENTS is the size of the group and
+    SEATS the number of seats it could use. Together these groups need more
+    seats than they can share.
+    """
+
+    def __init__(self, shortages):
+        super().__init__(shortages[0][0])
+        self.shortages = shortages
+
+    def __str__(self):
+        return 'Assignment failed! Not enough seats for: {}'.format('; '.join(
+            '{} ({} students, {} seats)'.format(describe(preference), students, seats)
+            for preference, students, seats in self.shortages
+        ))
+
+
+class FlowNetwork:
+    """A small Dinic max-flow solver over integer node ids."""
+
+    def __init__(self, size):
+        self.edges = [[] for _ in range(size)]
+
+    def add_edge(self, u, v, capacity):
+        # Each edge is [to, capacity, index of reverse edge]
+        self.edges[u].append([v, capacity, len(self.edges[v])])
+        self.edges[v].append([u, 0, len(self.edges[u]) - 1])
+        return self.edges[u][-1]
+
+    def levels(self, source):
+        level = [-1] * len(self.edges)
+        level[source] = 0
+        queue = [source]
+        for u in queue:
+            for v, capacity, _ in self.edges[u]:
+                if capacity > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        return level
+
+    def augment(self, u, sink, limit, level, progress):
+        if u == sink:
+            return limit
+        edges = self.edges[u]
+        while progress[u] < len(edges):
+            edge = edges[progress[u]]
+            v, capacity, reverse = edge
+            if capacity > 0 and level[v] == level[u] + 1:
+                pushed = self.augment(v, sink, min(limit, capacity), level, progress)
+                if pushed:
+                    edge[1] -= pushed
+                    self.edges[v][reverse][1] += pushed
+                    return pushed
+            progress[u] += 1
+        return 0
+
+    def push(self, edge, amount):
+        """Sends AMOUNT along EDGE, as if an augmenting path had used it."""
+        edge[1] -= amount
+        self.edges[edge[0]][edge[2]][1] += amount
+
+    def max_flow(self, source, sink):
+        flow = 0
+        while True:
+            level = self.levels(source)
+            if level[sink] < 0:
+                return flow
+            progress = [0] * len(self.edges)
+            pushed = self.augment(source, sink, float('inf'), level, progress)
+            while pushed:
+                flow += pushed
+                pushed = self.augment(source, sink, float('inf'), level, progress)
+
+
+def relevant_attributes(preferences):
+    """The attributes that some (wants, avoids) of PREFERENCES mentions.
+    Seats that differ only in other attributes are interchangeable."""
+    relevant = set()
+    for wants, avoids in preferences:
+        relevant |= wants | avoids
+    return relevant
+
+
+def suits(preference, attributes):
+    wants, avoids = preference
+    return wants <= attributes and not avoids & attributes
+
+
+class ClassFlow:
+    """The max-flow network that every solver here works on, between the few
+    preference groups and seat classes rather than individual students.
+
+    DEMAND maps each preference to its number of students, and SIZES maps
+    each seat class, a (room id, signature) pair, to its number of seats.
+    Callers that don't care about rooms use None as the room id. Flow runs
+    source -> preference -> every class that suits it -> sink. With LIMITS,
+    a dict from room id to the most students that room may take, classes
+    drain into one node per room capped at its limit instead.
+    """
+
+    def __init__(self, demand, sizes, limits=None):
+        self.demand = demand
+        self.sizes = sizes
+        self.students = sum(demand.values())
+        self.preferences = sorted(demand, key=lambda p: (sorted(p[0]), sorted(p[1])))
+        self.classes = sorted(sizes, key=lambda key: (key[0], sorted(key[1])))
+        room_ids = [] if limits is None else sorted(limits)
+        first_class = 1 + len(self.preferences)
+        first_room = first_class + len(self.classes)
+        self.source, self.sink = 0, first_room + len(room_ids)
+        self.network = FlowNetwork(self.sink + 1)
+        # Each is keyed like the node it leads out of or into
+        self.sources, self.edges, self.sinks, self.rooms = {}, collections.OrderedDict(), {}, {}
+        for i, preference in enumerate(self.preferences, 1):
+            self.sources[preference] = self.network.add_edge(self.source, i, demand[preference])
+            for j, key in enumerate(self.classes, first_class):
+                if suits(preference, key[1]):
+                    self.edges[preference, key] = self.network.add_edge(i, j, self.students)
+        nodes = {room_id: k for k, room_id in enumerate(room_ids, first_room)}
+        for j, key in enumerate(self.classes, first_class):
+            self.sinks[key] = self.network.add_edge(j, nodes.get(key[0], self.sink), sizes[key])
+        for room_id, k in nodes.items():
+            self.rooms[room_id] = self.network.add_edge(k, self.sink, limits[room_id])
+
+    def push(self, preference, key, amount):
+        """Records AMOUNT students of PREFERENCE already sitting in class KEY,
+        as if an augmenting path had put them there."""
+        self.network.push(self.sources[preference], amount)
+        self.network.push(self.edges[preference, key], amount)
+        self.network.push(self.sinks[key], amount)
+        if key[0] in self.rooms:
+            self.network.push(self.rooms[key[0]], amount)
+
+    def max_flow(self):
+        """Adds augmenting paths until none are left, returning how many
+        more students that seats."""
+        return self.network.max_flow(self.source, self.sink)
+
+    def flow(self, preference, key):
+        """How many students of PREFERENCE sit in seat class KEY."""
+        return self.students - self.edges[preference, key][1]
+
+    def used(self, key):
+        """How many seats of class KEY are taken."""
+        return self.sizes[key] - self.sinks[key][1]
+
+    def shortages(self):
+        """Lists (preference, students, seats) for the groups left unseated
+        after max_flow(), as for AssignmentInfeasible."""
+        # Groups still reachable from the source in the residual network form
+        # the smallest set whose demand exceeds the seats they can share
+        reachable = self.network.levels(self.source)
+        return [
+            (preference, self.demand[preference], sum(
+                self.sizes[key] for key in self.classes if (preference, key) in self.edges
+            ))
+            for i, preference in enumerate(self.preferences, 1) if reachable[i] >= 0
+        ]
+
+
+def class_flow(students, seats):
+    """Solves the assignment of STUDENTS to SEATS as a ClassFlow.
+
+    Students are grouped by (wants, avoids) and seats by the attributes that
+    some student cares about. Returns (groups, classes, quotas), where GROUPS
+    and CLASSES map each preference and seat class to its members, and QUOTAS
+    is an OrderedDict from (preference, seat class) to how many of that
+    group sit in that class in one complete assignment. Raises
+    AssignmentInfeasible describing the preference groups that cannot all
+    be seated.
+    """
+    groups = {}
+    for student in students:
+        groups.setdefault(preference_of(student), []).append(student)
+    relevant = relevant_attributes(groups)
+    classes = {}
+    for seat in seats:
+        classes.setdefault(frozenset(seat.attributes & relevant), []).append(seat)
+
+    flow = ClassFlow(
+        {preference: len(members) for preference, members in groups.items()},
+        {(None, signature): len(members) for signature, members in classes.items()},
+    )
+    if flow.max_flow() < len(students):
+        raise AssignmentInfeasible(flow.shortages())
+    quotas = collections.OrderedDict(
+        ((preference, key[1]), flow.flow(preference, key)) for preference, key in flow.edges
+    )
+    return groups, classes, quotas
+
+
+def match(students, seats, rng=None):
+    """Pairs every student with a seat if any complete assignment exists.
+
+    The assignment is solved by class_flow() between the few preference
+    groups and seat classes rather than between individual students.
+    Returns a list of (student, seat) pairs, or raises AssignmentInfeasible
+    describing the preference groups that cannot all be seated.
+    """
+    rng = rng or random.Random()
+    groups, classes, quotas = class_flow(students, seats)
+    for members in itertools.chain(groups.values(), classes.values()):
+        rng.shuffle(members)
+    pairs = []
+    for (preference, signature), flow in quotas.items():
+        for _ in range(flow):
+            pairs.append((groups[preference].pop(), classes[signature].pop()))
+    return pairs
+
+
+def rematch(kept, students, seats, pick, rng=None):
+    """Seats STUDENTS in the free SEATS, moving as few already seated
+    students as it takes.
+
+    KEPT counts the seated students whose seat still suits them, by
+    (preference, seat attributes); seated students whose seat no longer
+    suits them belong in STUDENTS, with their old seats in SEATS. The kept
+    students are loaded into the same flow network as match() as existing
+    flow, so max-flow only adds augmenting paths, and only the students
+    along them are fetched, with PICK(preference, attributes, count). The
+    network is between classes, so none of this looks at every seated
+    student. Returns (pairs, moved), where PAIRS are the new (student, seat)
+    pairs for every student who was seated or moved, and MOVED lists the
+    kept students who changed seats. Raises AssignmentInfeasible if not
+    everyone can be seated.
+    """
+    rng = rng or random.Random()
+    groups, free = {}, {}
+    moved = []
+    students, seats = list(students), list(seats)
+    for student in students:
+        groups.setdefault(preference_of(student), []).append(student)
+    for preference, _ in kept:
+        groups.setdefault(preference, [])
+    relevant = relevant_attributes(groups)
+    for seat in seats:
+        free.setdefault(frozenset(seat.attributes & relevant), []).append(seat)
+    occupied = collections.Counter()
+    for (preference, attributes), count in kept.items():
+        occupied[preference, frozenset(attributes & relevant)] += count
+    group_sizes = collections.Counter({p: len(members) for p, members in groups.items()})
+    class_sizes = collections.Counter({(None, s): len(members) for s, members in free.items()})
+    for (preference, signature), count in occupied.items():
+        group_sizes[preference] += count
+        class_sizes[None, signature] += count
+
+    flow = ClassFlow(group_sizes, class_sizes)
+    for (preference, signature), count in occupied.items():
+        flow.push(preference, (None, signature), count)
+    if flow.max_flow() < len(students):
+        raise AssignmentInfeasible(flow.shortages())
+
+    # Wherever a group now has fewer students in a class of seats than it
+    # did, move that many of them; their seats go to whoever gained there
+    changes = [
+        ((preference, key[1]), flow.flow(preference, key) - occupied[preference, key[1]])
+        for preference, key in flow.edges
+    ]
+    for (preference, signature), change in changes:
+        if change < 0:
+            # A class can hold seats with several sets of attributes
+            kinds = sorted((
+                (attributes, count) for (p, attributes), count in kept.items()
+                if p == preference and attributes & relevant == signature
+            ), key=lambda kind: sorted(kind[0]))
+            rng.shuffle(kinds)
+            needed = -change
+            for attributes, count in kinds:
+                for student, seat in pick(preference, attributes, min(count, needed)):
+                    moved.append(student)
+                    groups[preference].append(student)
+                    free.setdefault(signature, []).append(seat)
+                needed -= min(count, needed)
+                if not needed:
+                    break
+    for members in itertools.chain(groups.values(), free.values()):
+        rng.shuffle(members)
+    pairs = []
+    for (preference, signature), change in changes:
+        for _ in range(change):
+            pairs.append((groups[preference].pop(), free[signature].pop()))
+    return pairs, moved
+
+
+class SpatialIndex:
+    """A grid hash of taken seats, with one grid per room.
+
+    Cells are DISTANCE wide, so every seat closer than DISTANCE to a seat is
+    in that seat's cell or one of the eight around it, and checking for a
+    neighbour looks at a handful of seats rather than every seat taken.
+    """
+
+    def __init__(self, distance, seats=()):
+        self.distance = distance
+        self.size = distance if distance > 0 else 1
+        self.cells = {}
+        for seat in seats:
+            self.add(seat)
+
+    def cell(self, seat):
+        return seat.room_id, math.floor(seat.x / self.size), math.floor(seat.y / self.size)
+
+    def add(self, seat):
+        self.cells.setdefault(self.cell(seat), []).append(seat)
+
+    def crowded(self, seat):
+        """Whether any other taken seat is closer than DISTANCE to SEAT."""
+        room_id, x, y = self.cell(seat)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in self.cells.get((room_id, x + dx, y + dy), ()):
+                    if other is not seat and (other.x - seat.x) ** 2 + (other.y - seat.y) ** 2 < self.distance ** 2:
+                        return True
+        return False
+
+
+def spread(students, seats, distance, occupied=(), rng=None):
+    """Pairs STUDENTS with SEATS, keeping them at least DISTANCE apart (in
+    seat coordinates) from each other and the OCCUPIED seats where it can.
+
+    A complete assignment is solved first with class_flow(), and each
+    preference group only takes as many seats of each class as it has there,
+    so spacing students out never uses up seats another group needs.
+    Within that, groups are seated most constrained first, each student
+    taking the first seat it may use, in row order, that isn't too close to
+    a taken seat, which leaves gaps within and between rows. Students that
+    can't be spaced out are then seated with the distance halved, and so on,
+    and any still left get a plain match() over the remaining seats.
+    Returns a list of (student, seat) pairs, or raises AssignmentInfeasible
+    if not everyone can be seated.
+    """
+    rng = rng or random.Random()
+    seats = sorted(seats, key=lambda seat: (seat.room_id, seat.y, seat.x))
+    _, classes, quotas = class_flow(students, seats)
+    position = {id(seat): i for i, seat in enumerate(seats)}
+    signature = [None] * len(seats)
+    for key, members in classes.items():
+        for seat in members:
+            signature[position[id(seat)]] = key
+    index = SeatIndex(seats)
+    taken = [False] * len(seats)
+    free = index.all
+    pairs = []
+    remaining = list(students)
+    while remaining and distance >= 1:
+        grid = SpatialIndex(distance, itertools.chain(occupied, (seat for _, seat in pairs)))
+        leftover = []
+        for group in sorted(group_students(remaining, index, free), key=lambda g: g.count):
+            rng.shuffle(group.students)
+            # Seats only ever become taken or crowded and quotas only
+            # shrink, so one pass suffices
+            candidates = iter(group.candidates)
+            for student in group.students:
+                for i in candidates:
+                    if not taken[i] and quotas[group.preference, signature[i]] and not grid.crowded(seats[i]):
+                        break
+                else:
+                    leftover.append(student)
+                    continue
+                taken[i] = True
+                free &= ~(1 << i)
+                quotas[group.preference, signature[i]] -= 1
+                grid.add(seats[i])
+                pairs.append((student, seats[i]))
+        remaining = leftover
+        distance /= 2
+    if remaining:
+        pairs.extend(match(remaining, [seat for i, seat in enumerate(seats) if not taken[i]], rng))
+    return pairs
+
+
+def crowded_count(seats, distance):
+    """Counts the SEATS that have another of them closer than DISTANCE."""
+    grid = SpatialIndex(distance, seats)
+    return sum(1 for seat in seats if grid.crowded(seat))
+
+
+def seatable(demand, classes):
+    """Works out how many students of DEMAND, a dict from preference to the
+    number of students with it, fit in CLASSES, a dict from a set of seat
+    attributes to the number of seats with exactly those attributes.
+
+    Returns (students seated, shortages), where SHORTAGES is empty if they
+    all fit and otherwise as in AssignmentInfeasible.
+    """
+    seated, _, shortages = room_flow(demand, {None: classes})
+    return seated, shortages
+
+
+def room_flow(demand, rooms, limits=None):
+    """Works out how many students of DEMAND (as for seatable()) fit in ROOMS,
+    a dict from room id to seat classes (as for seatable()), when each room
+    takes at most LIMITS[room id] of them. Without LIMITS, every seat counts.
+
+    Returns (students seated, usage, shortages), where USAGE maps (room id,
+    seat attributes some student cares about) to how many students sit in
+    those seats in one best assignment, and SHORTAGES is as for seatable().
+    """
+    relevant = relevant_attributes(demand)
+    sizes = collections.Counter()
+    for room_id, classes in rooms.items():
+        for attributes, seats in classes.items():
+            sizes[room_id, frozenset(attributes & relevant)] += seats
+    flow = ClassFlow(demand, sizes, None if limits is None else {room_id: limits[room_id] for room_id in rooms})
+    seated = flow.max_flow()
+    usage = {key: flow.used(key) for key in flow.classes if flow.used(key)}
+    if seated == flow.students:
+        return seated, usage, []
+    return seated, usage, flow.shortages()
+
+
+def capped_seats(students, seats, limits):
+    """Picks which of SEATS STUDENTS may use so that no room gets more than
+    LIMITS[room id] of them, keeping the seats of one complete assignment.
+
+    Each room's seats are picked evenly through the room in row order,
+    first those the assignment needs and then others up to the room's
+    limit. Raises AssignmentInfeasible if the limits leave too few seats.
+    """
+    demand = collections.Counter(preference_of(student) for student in students)
+    relevant = relevant_attributes(demand)
+    rooms = {}
+    for seat in sorted(seats, key=lambda seat: (seat.room_id, seat.y, seat.x)):
+        rooms.setdefault(seat.room_id, {}).setdefault(frozenset(seat.attributes & relevant), []).append(seat)
+    seated, usage, shortages = room_flow(demand, {
+        room_id: {signature: len(members) for signature, members in classes.items()}
+        for room_id, classes in rooms.items()
+    }, {room_id: limits.get(room_id, 0) for room_id in rooms})
+    if seated < len(students):
+        raise AssignmentInfeasible(shortages)
+
+    def evenly(members, count):
+        return [members[k * len(members) // count] for k in range(count)]
+
+    picked = []
+    for room_id, classes in sorted(rooms.items()):
+        chosen = set()
+        for signature, members in classes.items():
+            chosen.update(id(seat) for seat in evenly(members, usage.get((room_id, signature), 0)))
+        rest = [seat for members in classes.values() for seat in members if id(seat) not in chosen]
+        rest.sort(key=lambda seat: (seat.y, seat.x))
+        chosen.update(id(seat) for seat in evenly(rest, min(len(rest), limits.get(room_id, 0) - len(chosen))))
+        picked.extend(seat for members in classes.values() for seat in members if id(seat) in chosen)
+    return picked
+
+
+def plan_rooms(demand, rooms, limits=None):
+    """Picks a small set of ROOMS that can seat DEMAND (as for room_flow())
+    without any room taking more than LIMITS[room id] students.
+
+    ROOMS maps a room id to its seat classes. Rooms are added one at a time,
+    each time the one that seats the most students still left over (the
+    largest on ties), then any room the others can do without is dropped,
+    smallest first. Returns the chosen room ids in fill order, or None if
+    even every room together can't meet the demand.
+    """
+    students = sum(demand.values())
+    sizes = {room_id: sum(classes.values()) for room_id, classes in rooms.items()}
+
+    def missing(room_ids):
+        seated, _, _ = room_flow(demand, {room_id: rooms[room_id] for room_id in room_ids}, limits)
+        return students - seated
+
+    def fits(room_ids):
+        return not missing(room_ids)
+
+    if not fits(rooms):
+        return None
+    chosen = []
+    while not fits(chosen):
+        chosen.append(min(
+            (room_id for room_id in rooms if room_id not in chosen),
+            key=lambda room_id: (missing(chosen + [room_id]), -sizes[room_id], room_id),
+        ))
+    for room_id in sorted(chosen, key=lambda r: (sizes[r], r)):
+        rest = [r for r in chosen if r != room_id]
+        if fits(rest):
+            chosen = rest
+    return chosen
@@ -0,0 +1,174 @@
+"""Set-based database writes for large imports and deletes.
+
+The ORM flushes one statement per object, which is slow for rooms with
+thousands of seats or rosters with thousands of students. These helpers
+take rows that have already been validated into plain tuples and write
+them with executemany batches, and delete with one statement per table.
+"""
+import collections
+import time
+
+from sqlalchemy import bindparam
+
+from server import app
+from server.models import ROOM_LAYOUTS, AttributeVocabulary, Room, Seat, SeatAssignment, Student, db, touch_rooms
+
+BATCH_SIZE = 1000
+
+SeatRow = collections.namedtuple('SeatRow', ['name', 'row', 'seat', 'x', 'y', 'attributes'])
+StudentRow = collections.namedtuple('StudentRow', ['email', 'name', 'sid', 'bcourses_id', 'wants', 'avoids'])
+
+
+def batches(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def insert_seats(room_id, seats, vocabulary):
+    for batch in batches(seats):
+        db.session.execute(Seat.__table__.insert(), [
+            {
+                'room_id': room_id,
+                'name': seat.name,
+                'row': seat.row,
+                'seat': seat.seat,
+                'x': seat.x,
+                'y': seat.y,
+                'attributes': seat.attributes,
+                'attribute_mask': vocabulary.encode(seat.attributes),
+            }
+            for seat in batch
+        ])
+    # Core inserts skip the session's after_flush hook
+    touch_rooms(db.session, [room_id])
+
+
+def insert_rooms(rooms):
+    """Inserts every (room, seats) pair in ROOMS in a single transaction.
+
+    ROOM is a new Room without seats and SEATS is a list of SeatRows.
+    Returns the number of seats written per second.
+    """
+    start = time.time()
+    total = 0
+    vocabularies = {}
+    try:
+        for room, seats in rooms:
+            if room.exam_id not in vocabularies:
+                vocabularies[room.exam_id] = AttributeVocabulary(room.exam_id)
+            db.session.add(room)
+            db.session.flush()
+            insert_seats(room.id, seats, vocabularies[room.exam_id])
+            total += len(seats)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    rate = total / max(time.time() - start, 1e-6)
+    app.logger.info('Imported %d seats in %d rooms (%.0f rows/s)', total, len(rooms), rate)
+    return rate
+
+
+def upsert_students(exam, students):
+    """Merges STUDENTS (a list of StudentRows) into EXAM's roster.
+
+    Existing students are loaded in one query and matched by email. New
+    students are inserted and changed ones updated in executemany batches,
+    in a single transaction. A blank sid or bCourses ID keeps the old one.
+    Returns the number of students (added, updated, unchanged).
+    """
+    start = time.time()
+    vocabulary = AttributeVocabulary(exam.id)
+    existing = {
+        student.email: student
+        for student in db.session.query(
+            Student.id, Student.email, Student.name, Student.sid,
+            Student.bcourses_id, Student.wants, Student.avoids,
+        ).filter(Student.exam_id == exam.id)
+    }
+    # Later rows for the same email win
+    rows = collections.OrderedDict((student.email, student) for student in students)
+    inserts, updates = [], []
+    for row in rows.values():
+        old = existing.get(row.email)
+        if old is None:
+            inserts.append({
+                'exam_id': exam.id,
+                'email': row.email,
+                'name': row.name,
+                'sid': row.sid,
+                'bcourses_id': row.bcourses_id,
+                'wants': row.wants,
+                'avoids': row.avoids,
+                'wants_mask': vocabulary.encode(row.wants),
+                'avoids_mask': vocabulary.encode(row.avoids),
+            })
+            continue
+        new = (row.name, row.sid or old.sid, row.bcourses_id or old.bcourses_id, row.wants, row.avoids)
+        if new != (old.name, old.sid, old.bcourses_id, old.wants, old.avoids):
+            updates.append(dict(zip(('_id', '_name', '_sid', '_bcourses_id', '_wants', '_avoids'), (old.id,) + new),
+                                _wants_mask=vocabulary.encode(row.wants),
+                                _avoids_mask=vocabulary.encode(row.avoids)))
+
+    update = Student.__table__.update().where(Student.id == bindparam('_id')).values(
+        name=bindparam('_name'),
+        sid=bindparam('_sid'),
+        bcourses_id=bindparam('_bcourses_id'),
+        wants=bindparam('_wants', type_=Student.wants.type),
+        avoids=bindparam('_avoids', type_=Student.avoids.type),
+        wants_mask=bindparam('_wants_mask'),
+        avoids_mask=bindparam('_avoids_mask'),
+    )
+    try:
+        for batch in batches(inserts):
+            db.session.execute(Student.__table__.insert(), batch)
+        for batch in batches(updates):
+            db.session.execute(update, batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    unchanged = len(rows) - len(inserts) - len(updates)
+    app.logger.info('Imported %d students (%d added, %d updated, %d unchanged) in %.2fs',
+                    len(rows), len(inserts), len(updates), unchanged, time.time() - start)
+    return len(inserts), len(updates), unchanged
+
+
+def delete_students(exam, emails):
+    """Deletes the students of EXAM with the given EMAILS, and their seat
+    assignments, in one transaction.
+
+    Returns the sets of emails that were deleted and that did not exist.
+    """
+    emails = {email for email in emails if email}
+    found = {}
+    for batch in batches(sorted(emails)):
+        found.update(db.session.query(Student.email, Student.id).filter(
+            Student.exam_id == exam.id,
+            Student.email.in_(batch),
+        ))
+    try:
+        for batch in batches(list(found.values())):
+            db.session.execute(SeatAssignment.__table__.delete().where(SeatAssignment.student_id.in_(batch)))
+            db.session.execute(Student.__table__.delete().where(Student.id.in_(batch)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return set(found), emails - set(found)
+
+
+def delete_room(room):
+    """Deletes ROOM with its seats and their assignments in one transaction."""
+    room_id = room.id
+    seat_ids = db.session.query(Seat.id).filter(Seat.room_id == room_id).subquery()
+    try:
+        db.session.execute(SeatAssignment.__table__.delete().where(SeatAssignment.seat_id.in_(seat_ids)))
+        db.session.execute(Seat.__table__.delete().where(Seat.room_id == room_id))
+        db.session.execute(Room.__table__.delete().where(Room.id == room_id))
+        db.session.expunge(room)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    ROOM_LAYOUTS.pop(room_id, None)
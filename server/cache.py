@@ -0,0 +1,101 @@
+"""A small in-process cache for lookups against slow remote services."""
+import collections
+import copy
+import threading
+import time
+
+
+class TTLCache:
+    """Caches FETCH(key) for TTL seconds, keeping at most MAX_SIZE keys.
+
+    Falsy results and errors are cached for NEGATIVE_TTL seconds instead, so
+    a flaky service isn't hammered. For STALE seconds after an entry expires
+    it is still returned immediately while a background thread refreshes it,
+    and returned instead of an error if the refresh fails. With STALE 0, no
+    entry is ever used past its TTL.
+    """
+
+    def __init__(self, fetch, ttl, negative_ttl, stale, max_size):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale = stale
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.stale_hits = self.errors = 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                value, error, expires = entry
+                if now < expires:
+                    self.hits += 1
+                    return self.unwrap(value, error)
+                if now < expires + self.stale and error is None:
+                    self.stale_hits += 1
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        thread = threading.Thread(target=self.refresh, args=(key,))
+                        thread.daemon = True
+                        thread.start()
+                    return value
+            self.misses += 1
+        value, error = self.load(key)
+        return self.unwrap(value, error)
+
+    def unwrap(self, value, error):
+        if error is not None:
+            # A copy, so tracebacks don't pile up on the cached exception
+            raise copy.copy(error)
+        return value
+
+    def load(self, key):
+        try:
+            value, error = self.fetch(key), None
+        except Exception as e:
+            value, error = None, e
+        with self.lock:
+            expires = None
+            if error is not None:
+                self.errors += 1
+                old = self.entries.get(key)
+                if old is not None and old[1] is None and time.time() < old[2] + self.stale:
+                    # Keep serving the last good value rather than failing,
+                    # but only until its stale window closes
+                    value, error, expires = old
+            if expires is None:
+                expires = time.time() + (self.ttl if value and error is None else self.negative_ttl)
+            self.entries[key] = (value, error, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value, error
+
+    def refresh(self, key):
+        try:
+            self.load(key)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'errors': self.errors,
+            }
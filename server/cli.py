@@ -0,0 +1,193 @@
+"""Flask CLI commands that work on an exam through the same code as the views.
+
+Commands that only touch the schema live with the models; these need the
+import and assignment code in server.views. CSV files are read a row at a
+time into the same parsing as a Google Sheet import, then written with the
+set-based helpers in server.bulk.
+
+Web workers cache exams for EXAM_CACHE_TTL seconds, so an exam activated
+or deactivated here takes up to that long to show up on the site.
+"""
+import csv
+import os
+import time
+
+import click
+
+from server import app, bulk
+from server.models import Exam, Room, Seat, SeatAssignment, Student, db
+from server.views import (
+    ASSIGN_MODES, ROOM_UTILIZATIONS, ValidationError, assign_job, assignment_report, dry_run, new_exam_room,
+    parse_seats, parse_students, sheet_rows,
+)
+
+
+def find_exam(offering, name):
+    exam = Exam.query.filter_by(offering=offering, name=name).first()
+    if not exam:
+        raise click.ClickException('No exam {} in {}'.format(name, offering))
+    return exam
+
+
+def read_csv_file(f):
+    """Returns the lowercase headers and a row iterator of CSV file F, like read_csv."""
+    return sheet_rows(csv.reader(f))
+
+
+@app.cli.command('previewassignment')
+@click.argument('offering')
+@click.argument('name')
+@click.option('--mode', type=click.Choice([mode for mode, _ in ASSIGN_MODES]), default=None,
+              help='Also run this assignment mode in memory')
+@click.option('--spacing', type=float, default=2, help='Distance between students for --mode spaced')
+def preview_assignment(offering, name, mode, spacing):
+    "Reports whether an exam's students fit its rooms, without saving anything"
+    exam = find_exam(offering, name)
+    report = assignment_report(exam)
+    click.echo('{} unassigned students, {} free seats, {} can be seated'.format(
+        report['students'], report['seats'], report['seated']))
+    click.echo()
+    click.echo('{:<40} {:>8} {:>8}'.format('Preference', 'Students', 'Seats'))
+    for preference in report['preferences']:
+        click.echo('{:<40} {:>8} {:>8}'.format(preference['preference'], preference['students'], preference['seats']))
+    click.echo()
+    click.echo('{:<40} {:>8} {:>8} {:>8}'.format('Room', 'Seats', 'Assigned', 'Expected'))
+    for room in report['rooms']:
+        click.echo('{:<40} {:>8} {:>8} {:>8}'.format(room['room'], room['seats'], room['assigned'], room['expected']))
+    if report['shortages']:
+        click.echo()
+        click.echo('Not enough seats for:')
+        for shortage in report['shortages']:
+            click.echo('  {} ({} students, {} seats)'.format(
+                shortage['preference'], shortage['students'], shortage['seats']))
+
+    if mode:
+        start = time.time()
+        result = dry_run(exam, mode, spacing=spacing)
+        click.echo()
+        if type(result) == str:
+            click.echo('{} assignment: {}'.format(mode, result))
+        else:
+            click.echo('{} assignment: would seat {} students ({:.2f}s)'.format(mode, len(result), time.time() - start))
+
+
+@app.cli.command('importrooms')
+@click.argument('offering')
+@click.argument('name')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def import_rooms(offering, name, paths):
+    """Imports a room from each CSV file, named after the file.
+
+    Each file has the columns of a room sheet. A bad file is reported and
+    skipped without stopping the rest.
+    """
+    exam = find_exam(offering, name)
+    failed = 0
+    for path in paths:
+        display_name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            room = new_exam_room(exam, display_name)
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                seats = parse_seats(*read_csv_file(f))
+            rate = bulk.insert_rooms([(room, seats)])
+        except (ValidationError, ValueError, UnicodeDecodeError, csv.Error) as e:
+            db.session.rollback()
+            failed += 1
+            click.echo('{}: {}'.format(display_name, e), err=True)
+        else:
+            click.echo('{}: imported {} seats ({:.0f} rows/s)'.format(display_name, len(seats), rate))
+    if failed:
+        raise click.ClickException('{} of {} rooms were not imported'.format(failed, len(paths)))
+
+
+@app.cli.command('importstudents')
+@click.argument('offering')
+@click.argument('name')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_students(offering, name, path):
+    """Adds or updates an exam's students from a CSV file with the columns of a roster sheet"""
+    exam = find_exam(offering, name)
+    start = time.time()
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            students = parse_students(*read_csv_file(f))
+        added, updated, unchanged = bulk.upsert_students(exam, students)
+    except (ValidationError, ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise click.ClickException(str(e))
+    elapsed = time.time() - start
+    click.echo('{} added, {} updated, {} unchanged ({:.0f} rows/s)'.format(
+        added, updated, unchanged, len(students) / max(elapsed, 1e-6)))
+
+
+@app.cli.command('assign')
+@click.argument('offering')
+@click.argument('name')
+@click.option('--mode', type=click.Choice([mode for mode, _ in ASSIGN_MODES]), default='greedy')
+@click.option('--spacing', type=float, default=2, help='Distance between students for --mode spaced')
+@click.option('--utilization', type=click.Choice([str(u) for u in ROOM_UTILIZATIONS]), default=None,
+              help='Use as few rooms as fit everyone at this share of their seats')
+def assign(offering, name, mode, spacing, utilization):
+    "Assigns seats to an exam's unassigned students, like the assign page"
+    exam = find_exam(offering, name)
+    start = time.time()
+    try:
+        message = assign_job(None, exam, mode, spacing=spacing, utilization=utilization)
+    except ValidationError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo('{} ({:.2f}s)'.format(message, time.time() - start))
+
+
+@app.cli.command('exportassignments')
+@click.argument('offering')
+@click.argument('name')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+def export_assignments(offering, name, output):
+    "Writes an exam's seat assignments as CSV to OUTPUT, or to stdout"
+    exam = find_exam(offering, name)
+    start = time.time()
+    rows = db.session.query(
+        Student.email, Student.name, Student.sid, Room.display_name, Seat.name, SeatAssignment.emailed,
+    ).select_from(SeatAssignment).join(
+        SeatAssignment.student,
+    ).join(
+        SeatAssignment.seat,
+    ).join(
+        Seat.room,
+    ).filter(
+        Room.exam_id == exam.id,
+    ).order_by(Room.display_name, Seat.y, Seat.x).yield_per(bulk.BATCH_SIZE)
+    writer = csv.writer(output)
+    writer.writerow(['email', 'name', 'student id', 'room', 'seat', 'emailed'])
+    count = 0
+    for email, student_name, sid, room, seat, emailed in rows:
+        writer.writerow([email, student_name, sid or '', room, seat, 'TRUE' if emailed else 'FALSE'])
+        count += 1
+    output.flush()
+    elapsed = time.time() - start
+    # On stderr, so it stays out of the CSV when OUTPUT is stdout
+    click.echo('Exported {} assignments ({:.0f} rows/s)'.format(count, count / max(elapsed, 1e-6)), err=True)
+
+
+@app.cli.command('activateexam')
+@click.argument('offering')
+@click.argument('name')
+def activate_exam(offering, name):
+    "Makes an exam the active one for its offering, deactivating the rest"
+    exam = find_exam(offering, name)
+    Exam.query.filter_by(offering=offering).update({'is_active': False})
+    exam.is_active = True
+    db.session.commit()
+    click.echo('Activated {} in {}'.format(name, offering))
+
+
+@app.cli.command('deactivateexams')
+@click.argument('offerings', nargs=-1)
+def deactivate_exams(offerings):
+    "Deactivates every exam of the given offerings, or of every offering"
+    query = Exam.query.filter_by(is_active=True)
+    if offerings:
+        query = query.filter(Exam.offering.in_(offerings))
+    count = query.update({'is_active': False}, synchronize_session=False)
+    db.session.commit()
+    click.echo('Deactivated {} exams'.format(count))
@@ -0,0 +1,178 @@
+"""Sends seat assignment emails through SendGrid.
+
+Pending assignments are loaded with their student, seat and room one batch
+per query and turned into SendGrid personalizations as they are sent, so
+only the batches in flight are ever in memory. Several batches are sent at
+once, failed batches are retried with backoff, and each delivered batch is
+marked emailed with a single UPDATE, so an interrupted run picks up where it
+left off.
+"""
+import concurrent.futures
+import time
+
+import sendgrid
+from sqlalchemy.orm import contains_eager
+
+from server import app, metrics
+from server.models import Room, Seat, SeatAssignment, db
+
+BATCH_SIZE = 900
+
+BODY = '''
+Hi -name-,
+
+Here's your assigned seat for {}:
+
+Room: -room-
+
+Seat: -seat-
+
+You can view this seat's position on the seating chart at:
+{}/seat/-seatid-/
+
+{}
+'''
+
+
+class EmailError(Exception):
+    pass
+
+
+def pending_assignments(exam):
+    """Queries every unemailed assignment of EXAM with its student, seat and room."""
+    return SeatAssignment.query.join(SeatAssignment.student).join(SeatAssignment.seat).join(Seat.room).filter(
+        Room.exam_id == exam.id,
+        SeatAssignment.emailed == False,
+    ).options(
+        contains_eager(SeatAssignment.student),
+        contains_eager(SeatAssignment.seat).contains_eager(Seat.room),
+    ).order_by(SeatAssignment.student_id)
+
+
+def progress(exam):
+    """Returns (emailed, total) assignment counts for EXAM."""
+    query = db.session.query(SeatAssignment).join(SeatAssignment.seat).join(Seat.room).filter(
+        Room.exam_id == exam.id,
+    )
+    return query.filter(SeatAssignment.emailed == True).count(), query.count()
+
+
+def personalization(assignment, to=None):
+    return {
+        'to': [
+            {
+                'email': to or assignment.student.email,
+            }
+        ],
+        'substitutions': {
+            '-name-': assignment.student.first_name,
+            '-room-': assignment.seat.room.display_name,
+            '-seat-': assignment.seat.name,
+            '-seatid-': str(assignment.seat.id),
+        },
+    }
+
+
+def batches(query, size=None):
+    """Yields the assignments of QUERY, which must be ordered by student id,
+    as lists of SIZE (by default BATCH_SIZE) (student id, personalization).
+
+    Each batch is queried on its own, starting after the last student of the
+    batch before, so the caller may commit between batches without the
+    remaining rows expiring.
+    """
+    size = size or BATCH_SIZE
+    last = None
+    while True:
+        page = query if last is None else query.filter(SeatAssignment.student_id > last)
+        batch = [(assignment.student_id, personalization(assignment)) for assignment in page.limit(size)]
+        if batch:
+            yield batch
+        if len(batch) < size:
+            return
+        last = batch[-1][0]
+
+
+def send(data):
+    """Posts one SendGrid request, retrying with exponential backoff."""
+    sg = sendgrid.SendGridAPIClient(api_key=app.config['SENDGRID_API_KEY'], host=app.config['SENDGRID_HOST'])
+    retries = app.config['EMAIL_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            with metrics.outbound('sendgrid'):
+                response = sg.client.mail.send.post(request_body=data)
+            status, body = response.status_code, response.body
+        except Exception as e:
+            # python_http_client raises on 4xx/5xx responses
+            status, body = getattr(e, 'status_code', None), getattr(e, 'body', str(e))
+        if status is not None and 200 <= status < 400:
+            return
+        if attempt < retries:
+            time.sleep(app.config['EMAIL_BACKOFF'] * 2 ** attempt)
+    raise EmailError('Could not send mail. Status: {}. Body: {}'.format(status, body))
+
+
+def mark_emailed(student_ids):
+    SeatAssignment.query.filter(
+        SeatAssignment.student_id.in_(student_ids),
+    ).update({'emailed': True}, synchronize_session=False)
+    db.session.commit()
+
+
+def email_students(exam, message, root_url, test=None, on_progress=None):
+    """Emails every unemailed student of EXAM their seat.
+
+    MESSAGE holds the 'from', 'subject' and 'additional_text' of the email.
+    With TEST, sends a single sample to that address and marks nothing. Calls
+    ON_PROGRESS with the number of students emailed so far after each batch.
+    """
+    def payload(personalizations):
+        return {
+            'personalizations': personalizations,
+            'from': message['from'],
+            'subject': message['subject'],
+            'content': [
+                {
+                    'type': 'text/plain',
+                    'value': BODY.format(exam.display_name, root_url, message['additional_text']),
+                },
+            ],
+        }
+
+    if test:
+        assignment = pending_assignments(exam).first()
+        if assignment:
+            send(payload([personalization(assignment, to=test)]))
+        return
+
+    # The session isn't thread-safe, so batches are queried and recorded on
+    # this thread and workers only talk to SendGrid
+    sent, errors = 0, []
+    workers = app.config['EMAIL_WORKERS']
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+
+        def collect(done):
+            nonlocal sent
+            for future in done:
+                student_ids = in_flight.pop(future)
+                try:
+                    future.result()
+                except EmailError as e:
+                    errors.append(e)
+                    continue
+                mark_emailed(student_ids)
+                sent += len(student_ids)
+                if on_progress:
+                    on_progress(sent)
+
+        for batch in batches(pending_assignments(exam)):
+            if len(in_flight) >= workers:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(done)
+            student_ids, personalizations = zip(*batch)
+            in_flight[pool.submit(send, payload(list(personalizations)))] = student_ids
+        collect(concurrent.futures.as_completed(list(in_flight)))
+    if errors:
+        raise errors[0]
+    return sent
@@ -0,0 +1,145 @@
+"""Runs long admin operations in the background.
+
+Routes enqueue a Job row instead of doing the work inside the request.
+Every web process starts a few worker threads that claim queued jobs from
+the database, so no broker is needed beyond the existing database and a
+job survives the process that enqueued it. Handlers report progress back
+onto the Job row, which the per-exam jobs page polls. While a job runs its
+worker touches the row every JOB_HEARTBEAT_INTERVAL seconds, and a running
+job not touched for JOB_TIMEOUT seconds is failed, since the process
+running it must have died or been restarted.
+"""
+import datetime
+import json
+import threading
+
+from server import app
+from server.models import Job, db
+
+HANDLERS = {}
+
+wakeup = threading.Event()
+workers = []
+workers_lock = threading.Lock()
+
+
+def handler(kind):
+    """Registers the decorated function to run jobs of KIND.
+
+    It is called as fn(job, exam, **args) inside an app context, and its
+    return value becomes the job's message.
+    """
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(exam, kind, **args):
+    job = Job(exam_id=exam.id, kind=kind, args=json.dumps(args))
+    db.session.add(job)
+    db.session.commit()
+    start_workers()
+    wakeup.set()
+    return job
+
+
+def report(job, progress, total=None):
+    """Records a job's progress without touching the handler's session."""
+    values = {'progress': progress, 'updated_at': datetime.datetime.utcnow()}
+    if total is not None:
+        values['total'] = total
+    db.engine.execute(Job.__table__.update().where(Job.id == job.id).values(**values))
+
+
+def fail_abandoned():
+    """Fails running jobs whose worker has stopped sending heartbeats."""
+    now = datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(seconds=app.config['JOB_TIMEOUT'])
+    failed = Job.query.filter(Job.status == 'running', Job.updated_at < cutoff).update({
+        'status': 'failed',
+        'message': 'The worker running this job stopped before it finished. Please try again.',
+        'updated_at': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return failed
+
+
+def claim():
+    """Marks the oldest queued job as running and returns it, if any.
+
+    The conditional UPDATE makes sure only one worker in any process
+    gets each job.
+    """
+    fail_abandoned()
+    for job_id, in db.session.query(Job.id).filter_by(status='queued').order_by(Job.id).limit(10):
+        claimed = Job.query.filter_by(id=job_id, status='queued').update({
+            'status': 'running',
+            'updated_at': datetime.datetime.utcnow(),
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def heartbeat(job_id, stop):
+    with app.app_context():
+        while not stop.wait(app.config['JOB_HEARTBEAT_INTERVAL']):
+            db.engine.execute(Job.__table__.update().where(Job.id == job_id).values(
+                updated_at=datetime.datetime.utcnow(),
+            ))
+
+
+def run(job):
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(job.id, stop), name='job-heartbeat-{}'.format(job.id))
+    beat.daemon = True
+    beat.start()
+    try:
+        message = HANDLERS[job.kind](job, job.exam, **json.loads(job.args))
+        status = 'done'
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('Job %d (%s) failed', job.id, job.kind)
+        message, status = str(e), 'failed'
+    finally:
+        stop.set()
+    Job.query.filter_by(id=job.id).update({
+        'status': status,
+        'message': message,
+        'updated_at': datetime.datetime.utcnow(),
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def work():
+    with app.app_context():
+        while True:
+            try:
+                job = claim()
+                if job:
+                    run(job)
+            except Exception:
+                app.logger.exception('Job worker error')
+                job = None
+            finally:
+                db.session.remove()
+            if not job:
+                wakeup.wait(app.config['JOB_POLL_INTERVAL'])
+                wakeup.clear()
+
+
+def start_workers():
+    with workers_lock:
+        while len(workers) < app.config['JOB_WORKERS']:
+            worker = threading.Thread(target=work, name='job-worker-{}'.format(len(workers)))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+
+@app.before_first_request
+def pick_up_queued_jobs():
+    # Jobs enqueued by a process that has since exited
+    start_workers()
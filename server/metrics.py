@@ -0,0 +1,275 @@
+"""Opt-in request instrumentation.
+
+With METRICS_ENABLED, each request records its wall time, the number and
+duration of its SQL statements, its calls to the auth server, sheets proxy
+and SendGrid, and the time spent rendering templates. Outside calls are
+also labelled with the endpoint that made them. Each worker keeps
+totals per endpoint and serves them in Prometheus text format at /metrics.
+With PROFILE_SAMPLE_RATE set, that fraction of requests also runs under
+cProfile, and each worker writes its PROFILE_KEEP slowest profiles to
+PROFILE_DIRECTORY.
+"""
+import contextlib
+import cProfile
+import heapq
+import os
+import random
+import threading
+import time
+import uuid
+
+import flask
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from server import app
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Record:
+    """What one request has done so far."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.status = None
+        self.sql_count = 0
+        self.sql_seconds = 0
+        self.template_seconds = 0
+        # (service, seconds, failed) of outside calls made before the URL
+        # was matched, labelled once the endpoint is known
+        self.outbound = []
+        self.profile = None
+
+
+def current():
+    """The Record of the request on this thread, if it is being measured."""
+    ctx = flask._request_ctx_stack.top
+    return getattr(ctx, 'metrics', None)
+
+
+class Registry:
+    """Per-worker totals, keyed by the label values they are exported with."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (endpoint, method, status) -> requests
+        self.requests = {}
+        # Endpoint -> [count in each bucket, total seconds, requests]
+        self.durations = {}
+        # Endpoint -> [statements, seconds]
+        self.sql = {}
+        # Endpoint -> seconds
+        self.templates = {}
+        # (service, endpoint) -> [calls, errors, seconds]
+        self.outbound = {}
+
+    def observe_request(self, endpoint, method, record, seconds):
+        with self.lock:
+            key = (endpoint, method, str(record.status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            duration = self.durations.setdefault(endpoint, [0] * len(REQUEST_BUCKETS) + [0, 0])
+            for i, bound in enumerate(REQUEST_BUCKETS):
+                if seconds <= bound:
+                    duration[i] += 1
+            duration[-2] += seconds
+            duration[-1] += 1
+            sql = self.sql.setdefault(endpoint, [0, 0])
+            sql[0] += record.sql_count
+            sql[1] += record.sql_seconds
+            self.templates[endpoint] = self.templates.get(endpoint, 0) + record.template_seconds
+
+    def observe_outbound(self, service, endpoint, seconds, failed):
+        with self.lock:
+            calls = self.outbound.setdefault((service, endpoint), [0, 0, 0])
+            calls[0] += 1
+            calls[1] += failed
+            calls[2] += seconds
+
+    def exposition(self):
+        def labels(**values):
+            return '{' + ','.join('{}="{}"'.format(k, v) for k, v in sorted(values.items())) + '}'
+
+        def family(name, kind, help, samples):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, label, value in samples:
+                lines.append('{}{}{} {}'.format(name, suffix, label, value))
+
+        lines = []
+        with self.lock:
+            family('seating_requests_total', 'counter', 'Requests handled.', [
+                ('', labels(endpoint=endpoint, method=method, status=status), count)
+                for (endpoint, method, status), count in sorted(self.requests.items())
+            ])
+            samples = []
+            for endpoint, duration in sorted(self.durations.items()):
+                for bound, count in zip(REQUEST_BUCKETS, duration):
+                    samples.append(('_bucket', labels(endpoint=endpoint, le=bound), count))
+                samples.append(('_bucket', labels(endpoint=endpoint, le='+Inf'), duration[-1]))
+                samples.append(('_sum', labels(endpoint=endpoint), duration[-2]))
+                samples.append(('_count', labels(endpoint=endpoint), duration[-1]))
+            family('seating_request_duration_seconds', 'histogram', 'Wall time of requests.', samples)
+            family('seating_sql_statements_total', 'counter', 'SQL statements run by requests.', [
+                ('', labels(endpoint=endpoint), sql[0]) for endpoint, sql in sorted(self.sql.items())
+            ])
+            family('seating_sql_seconds_total', 'counter', 'Time requests spent in SQL statements.', [
+                ('', labels(endpoint=endpoint), sql[1]) for endpoint, sql in sorted(self.sql.items())
+            ])
+            family('seating_template_seconds_total', 'counter', 'Time requests spent rendering templates.', [
+                ('', labels(endpoint=endpoint), seconds) for endpoint, seconds in sorted(self.templates.items())
+            ])
+            family('seating_outbound_requests_total', 'counter', 'Calls to the auth server, sheets and SendGrid.', [
+                ('', labels(service=service, endpoint=endpoint), calls[0])
+                for (service, endpoint), calls in sorted(self.outbound.items())
+            ])
+            family('seating_outbound_errors_total', 'counter', 'Failed calls to outside services.', [
+                ('', labels(service=service, endpoint=endpoint), calls[1])
+                for (service, endpoint), calls in sorted(self.outbound.items())
+            ])
+            family('seating_outbound_seconds_total', 'counter', 'Time spent calling outside services.', [
+                ('', labels(service=service, endpoint=endpoint), calls[2])
+                for (service, endpoint), calls in sorted(self.outbound.items())
+            ])
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Profiles:
+    """Keeps the slowest sampled profiles of this worker on disk."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Min-heap of (seconds, path), so the fastest kept profile is first
+        self.kept = []
+
+    def offer(self, profile, endpoint, seconds):
+        with self.lock:
+            if len(self.kept) >= app.config['PROFILE_KEEP'] and seconds <= self.kept[0][0]:
+                return
+            directory = app.config['PROFILE_DIRECTORY']
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '{}-{}ms-{}-{}.prof'.format(
+                endpoint, int(seconds * 1000), os.getpid(), uuid.uuid4().hex[:8],
+            ))
+            profile.dump_stats(path)
+            heapq.heappush(self.kept, (seconds, path))
+            while len(self.kept) > app.config['PROFILE_KEEP']:
+                _, evicted = heapq.heappop(self.kept)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+
+profiles = Profiles()
+
+
+class Instrumentation:
+    """Started and finished by UrlRequestContext around every request."""
+
+    def start(self, ctx):
+        record = ctx.metrics = Record()
+        if random.random() < app.config['PROFILE_SAMPLE_RATE']:
+            record.profile = cProfile.Profile()
+            try:
+                record.profile.enable()
+            except ValueError:
+                # Another profiler is already running on this interpreter
+                record.profile = None
+
+    def finish(self, ctx):
+        record = getattr(ctx, 'metrics', None)
+        if record is None:
+            return
+        seconds = time.perf_counter() - record.start
+        if record.profile:
+            record.profile.disable()
+        ctx.metrics = None
+        rule = ctx.request.url_rule
+        endpoint = rule.endpoint if rule else 'unmatched'
+        for service, call_seconds, failed in record.outbound:
+            registry.observe_outbound(service, endpoint, call_seconds, failed)
+        if record.status is None:
+            # No response was made, as in test_request_context()
+            return
+        registry.observe_request(endpoint, ctx.request.method, record, seconds)
+        if record.profile:
+            profiles.offer(record.profile, endpoint, seconds)
+
+
+def current_endpoint():
+    """The endpoint of the request on this thread, or 'none' in background
+    jobs and worker threads."""
+    if not flask.has_request_context():
+        return 'none'
+    return flask.request.endpoint or 'unmatched'
+
+
+@contextlib.contextmanager
+def outbound(service):
+    """Times a call to an outside SERVICE, if instrumentation is on, and
+    attributes it to the endpoint of the request making it."""
+    if app.instrumentation is None:
+        yield
+        return
+    record = current()
+    matching = record is not None and flask.request.url_rule is None
+    endpoint = current_endpoint()
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        seconds = time.perf_counter() - start
+        if matching:
+            # URL converters call out before the endpoint is known
+            record.outbound.append((service, seconds, failed))
+        else:
+            registry.observe_outbound(service, endpoint, seconds, failed)
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        record = current()
+        if record is None:
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            record.template_seconds += time.perf_counter() - start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    record = current()
+    if record is not None:
+        record.sql_count += 1
+        record.sql_seconds += seconds
+
+
+def record_status(response):
+    record = current()
+    if record is not None:
+        record.status = response.status_code
+    return response
+
+
+if app.config['METRICS_ENABLED']:
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.jinja_env.template_class = TimedTemplate
+    app.after_request(record_status)
+    app.instrumentation = Instrumentation()
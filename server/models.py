@@ -1,11 +1,15 @@
 import click
+import collections
+import datetime
+import hashlib
 import itertools
 from natsort import natsorted
 import re
+import uuid
 
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import PrimaryKeyConstraint, types
+from sqlalchemy import PrimaryKeyConstraint, bindparam, event, inspect, types
 from sqlalchemy.orm import backref
 
 from server import app
@@ -31,6 +35,9 @@ class User(db.Model, UserMixin):
 
 class Exam(db.Model):
     __tablename__ = 'exams'
+    __table_args__ = (
+        db.Index('ix_exams_offering_is_active', 'offering', 'is_active'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     offering = db.Column(db.String(255), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False, index=True)
@@ -43,6 +50,10 @@ class Room(db.Model):
     exam_id = db.Column(db.ForeignKey('exams.id'), index=True, nullable=False)
     name = db.Column(db.String(255), nullable=False, index=True)
     display_name = db.Column(db.String(255), nullable=False)
+    # Replaced whenever the room's seats change, so every worker can tell its
+    # cached layout is stale. Random rather than a counter, since SQLite can
+    # give a deleted room's id to a new one.
+    version = db.Column(db.String(32), default=lambda: uuid.uuid4().hex, server_default='', nullable=False)
 
     exam = db.relationship('Exam', backref=backref('rooms', order_by='Room.display_name'))
 
@@ -54,6 +65,59 @@ class Room(db.Model):
             for _, g in itertools.groupby(seats, lambda seat: seat.row)
         ]
 
+    @property
+    def layout(self):
+        """The room's RoomLayout, cached per worker until the room's version changes."""
+        if self.id is None:
+            # Previews of rooms that haven't been saved yet
+            return RoomLayout(self)
+        layout = ROOM_LAYOUTS.get(self.id)
+        if layout is None or layout.room_version != self.version:
+            layout = ROOM_LAYOUTS[self.id] = RoomLayout(self)
+        return layout
+
+
+LayoutSeat = collections.namedtuple('LayoutSeat', ['id', 'name', 'attributes', 'left', 'top'])
+
+class RoomLayout:
+    """Everything needed to draw a room's seating chart.
+
+    Rows are sorted and seat positions converted to pixels once, so rendering
+    a chart doesn't re-sort or re-scan the room's seats. VERSION changes
+    whenever any seat does.
+    """
+    scale = 23
+
+    def __init__(self, room):
+        self.room_version = room.version
+        seats = room.seats
+        if seats:
+            x_min = min(seat.x for seat in seats)
+            x_max = max(seat.x for seat in seats)
+            y_min = min(seat.y for seat in seats)
+            y_max = max(seat.y for seat in seats)
+        else:
+            x_min = x_max = y_min = y_max = 0
+        self.width = self.scale * (x_max - x_min + 1)
+        self.height = self.scale * (y_max - y_min + 1)
+        self.rows = [
+            [
+                LayoutSeat(
+                    seat.id,
+                    seat.name,
+                    tuple(sorted(seat.attributes)),
+                    self.scale * (x_max - seat.x),
+                    self.scale * (seat.y - y_min),
+                )
+                for seat in row
+            ]
+            for row in room.rows
+        ]
+        self.version = hashlib.sha1(repr(self.rows).encode()).hexdigest()[:12]
+
+# Room id -> RoomLayout
+ROOM_LAYOUTS = {}
+
 class Seat(db.Model):
     __tablename__ = 'seats'
     id = db.Column(db.Integer, primary_key=True)
@@ -64,11 +128,18 @@ class Seat(db.Model):
     x = db.Column(db.Float, nullable=False)
     y = db.Column(db.Float, nullable=False)
     attributes = db.Column(StringSet, nullable=False)
+    # The same attributes as bits of the exam's AttributeVocabulary. The
+    # attribute sets are authoritative: server.bulk writes both, and
+    # encode_attribute_masks derives the masks for ORM writes.
+    attribute_mask = db.Column(db.BigInteger, default=0, server_default='0', nullable=False)
 
     room = db.relationship('Room', backref='seats')
 
 class Student(db.Model):
     __tablename__ = 'students'
+    __table_args__ = (
+        db.Index('ix_students_exam_id_email', 'exam_id', 'email'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     exam_id = db.Column(db.ForeignKey('exams.id'), index=True, nullable=False)
     email = db.Column(db.String(255), index=True, nullable=False)
@@ -77,6 +148,9 @@ class Student(db.Model):
     bcourses_id = db.Column(db.String(255))
     wants = db.Column(StringSet, nullable=False)
     avoids = db.Column(StringSet, nullable=False)
+    # Derived from WANTS and AVOIDS, like Seat.attribute_mask
+    wants_mask = db.Column(db.BigInteger, default=0, server_default='0', nullable=False)
+    avoids_mask = db.Column(db.BigInteger, default=0, server_default='0', nullable=False)
 
     exam = db.relationship('Exam', backref='students')
 
@@ -84,6 +158,81 @@ class Student(db.Model):
     def first_name(self):
         return self.name.rsplit(',', 1)[-1].strip().title()
 
+class Attribute(db.Model):
+    """Which bit of the attribute masks stands for an attribute in an exam."""
+    __tablename__ = 'attributes'
+    __table_args__ = (
+        db.UniqueConstraint('exam_id', 'name'),
+        db.UniqueConstraint('exam_id', 'bit'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    exam_id = db.Column(db.ForeignKey('exams.id'), index=True, nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    bit = db.Column(db.Integer, nullable=False)
+
+    exam = db.relationship('Exam')
+
+class AttributeVocabulary:
+    """Encodes an exam's attribute names as bitmasks and back.
+
+    Masks are stored as signed 64-bit integers, so an exam can have at most
+    MAX_ATTRIBUTES distinct seat and student attributes. For an exam that
+    hasn't been flushed yet, pass the Exam as PENDING instead of an id.
+    """
+    MAX_ATTRIBUTES = 63
+
+    def __init__(self, exam_id, pending=None):
+        self.exam_id = exam_id
+        self.pending = pending
+        if pending is None:
+            self.bits = {
+                name: bit for name, bit in
+                db.session.query(Attribute.name, Attribute.bit).filter(Attribute.exam_id == exam_id)
+            }
+        else:
+            self.bits = {}
+        self.decoded = {}
+
+    def encode(self, names):
+        """Returns the mask for NAMES, adding any new names to the exam."""
+        mask = 0
+        for name in names:
+            if name not in self.bits:
+                self.add(name)
+            mask |= 1 << self.bits[name]
+        return mask
+
+    def add(self, name):
+        """Gives NAME the exam's next free bit.
+
+        Locks the exam's row until the transaction ends, so two imports that
+        both bring in new attributes can't pick the same bit, then re-reads
+        the bits in case another import added some while this one waited.
+        A pending exam isn't visible to anyone else, so needs neither.
+        """
+        if self.pending is None:
+            db.session.query(Exam.id).filter(Exam.id == self.exam_id).with_for_update().one()
+            self.bits.update(
+                db.session.query(Attribute.name, Attribute.bit).filter(Attribute.exam_id == self.exam_id).with_for_update()
+            )
+            if name in self.bits:
+                return
+        if len(self.bits) >= self.MAX_ATTRIBUTES:
+            raise ValueError('An exam can have at most {} attributes'.format(self.MAX_ATTRIBUTES))
+        self.bits[name] = max(self.bits.values(), default=-1) + 1
+        attribute = Attribute(exam_id=self.exam_id, name=name, bit=self.bits[name])
+        if self.pending is not None:
+            attribute.exam = self.pending
+        db.session.add(attribute)
+
+    def decode(self, mask):
+        names = self.decoded.get(mask)
+        if names is None:
+            names = self.decoded[mask] = frozenset(
+                name for name, bit in self.bits.items() if mask & (1 << bit)
+            )
+        return names
+
 class SeatAssignment(db.Model):
     __tablename__ = 'seat_assignments'
     __table_args__ = (
@@ -96,6 +245,84 @@ class SeatAssignment(db.Model):
     student = db.relationship('Student', backref=backref('assignment', uselist=False))
     seat = db.relationship('Seat', backref=backref('assignment', uselist=False))
 
+@event.listens_for(db.session, 'before_flush')
+def encode_attribute_masks(session, context, instances):
+    vocabularies = {}
+
+    def vocabulary(owner):
+        # OWNER's exam may be new in this same flush, and so have no id yet
+        key = owner.exam_id
+        if key is None:
+            key = owner.exam.id or owner.exam
+        if key not in vocabularies:
+            if isinstance(key, Exam):
+                vocabularies[key] = AttributeVocabulary(None, pending=key)
+            else:
+                vocabularies[key] = AttributeVocabulary(key)
+        return vocabularies[key]
+
+    for obj in list(itertools.chain(session.new, session.dirty)):
+        if isinstance(obj, Seat):
+            columns = ('attributes',)
+        elif isinstance(obj, Student):
+            columns = ('wants', 'avoids')
+        else:
+            continue
+        if obj not in session.new and not any(inspect(obj).attrs[column].history.has_changes() for column in columns):
+            continue
+        if isinstance(obj, Seat):
+            room = obj.room or Room.query.get(obj.room_id)
+            obj.attribute_mask = vocabulary(room).encode(sorted(obj.attributes))
+        else:
+            obj.wants_mask = vocabulary(obj).encode(sorted(obj.wants))
+            obj.avoids_mask = vocabulary(obj).encode(sorted(obj.avoids))
+
+def touch_rooms(session, room_ids):
+    """Gives the rooms with ROOM_IDS a new version after their seats change,
+    so every worker rebuilds their layouts on its next read."""
+    room_ids = sorted(set(room_ids) - {None})
+    if not room_ids:
+        return
+    session.execute(Room.__table__.update().where(Room.id.in_(room_ids)).values(version=uuid.uuid4().hex))
+    for room_id in room_ids:
+        ROOM_LAYOUTS.pop(room_id, None)
+
+@event.listens_for(db.session, 'after_flush')
+def invalidate_layouts(session, context):
+    for obj in session.deleted:
+        if isinstance(obj, Room):
+            ROOM_LAYOUTS.pop(obj.id, None)
+    changed = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        # Assigning a student marks a seat dirty without changing its layout
+        if isinstance(obj, Seat) and (obj not in session.dirty or any(
+                inspect(obj).attrs[column].history.has_changes()
+                for column in ('name', 'row', 'x', 'y', 'attributes', 'room_id'))):
+            changed.add(obj.room_id)
+            changed.update(inspect(obj).attrs.room_id.history.deleted)
+    changed -= {obj.id for obj in session.deleted if isinstance(obj, Room)}
+    touch_rooms(session, changed)
+
+class Job(db.Model):
+    """A long-running admin operation, run in the background by server.jobs."""
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    exam_id = db.Column(db.ForeignKey('exams.id'), index=True, nullable=False)
+    kind = db.Column(db.String(255), nullable=False)
+    args = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(255), default='queued', index=True, nullable=False)
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer)
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    exam = db.relationship('Exam', backref=backref('jobs', order_by='Job.id.desc()', lazy='dynamic'))
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
 def slug(display_name):
     return re.sub(r'[^A-Za-z0-9._-]', '', display_name.lower())
 
@@ -116,6 +343,71 @@ def drop_db():
         click.echo('Dropping database...')
         db.drop_all()
 
+@app.cli.command('migrateattributes')
+def migrate_attributes():
+    "Adds attribute mask columns and fills them from the attribute lists"
+    db.create_all()
+    columns = {
+        'seats': ['attribute_mask'],
+        'students': ['wants_mask', 'avoids_mask'],
+    }
+    inspector = inspect(db.engine)
+    for table, names in columns.items():
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name in names:
+            if name not in existing:
+                click.echo('Adding {}.{}...'.format(table, name))
+                db.engine.execute('ALTER TABLE {} ADD COLUMN {} BIGINT NOT NULL DEFAULT 0'.format(table, name))
+
+    for exam in Exam.query.all():
+        click.echo('Encoding attributes for {} {}...'.format(exam.offering, exam.name))
+        vocabulary = AttributeVocabulary(exam.id)
+        seats = db.session.query(Seat.id, Seat.attributes).join(Seat.room).filter(Room.exam_id == exam.id).all()
+        seat_masks = [
+            {'_id': seat_id, '_mask': vocabulary.encode(sorted(attributes))}
+            for seat_id, attributes in seats
+        ]
+        students = db.session.query(Student.id, Student.wants, Student.avoids).filter(Student.exam_id == exam.id).all()
+        student_masks = [
+            {'_id': student_id, '_wants': vocabulary.encode(sorted(wants)), '_avoids': vocabulary.encode(sorted(avoids))}
+            for student_id, wants, avoids in students
+        ]
+        if seat_masks:
+            db.session.execute(Seat.__table__.update().where(Seat.id == bindparam('_id')).values(
+                attribute_mask=bindparam('_mask'),
+            ), seat_masks)
+        if student_masks:
+            db.session.execute(Student.__table__.update().where(Student.id == bindparam('_id')).values(
+                wants_mask=bindparam('_wants'),
+                avoids_mask=bindparam('_avoids'),
+            ), student_masks)
+        db.session.commit()
+
+@app.cli.command('migrateroomversions')
+def migrate_room_versions():
+    "Adds the rooms.version column and gives every room a version"
+    inspector = inspect(db.engine)
+    if 'version' not in {column['name'] for column in inspector.get_columns('rooms')}:
+        click.echo('Adding rooms.version...')
+        db.engine.execute("ALTER TABLE rooms ADD COLUMN version VARCHAR(32) NOT NULL DEFAULT ''")
+    for room_id, in db.session.query(Room.id).filter(Room.version == ''):
+        db.session.execute(Room.__table__.update().where(Room.id == room_id).values(version=uuid.uuid4().hex))
+    db.session.commit()
+
+@app.cli.command('migrateindexes')
+def migrate_indexes():
+    "Creates any indexes missing from existing tables"
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                click.echo('Creating {}...'.format(index.name))
+                index.create(db.engine)
+
 # For development purposes only
 @app.cli.command('seeddb')
 def seed_db():
@@ -0,0 +1,280 @@
+"""Roster photo storage.
+
+Photos live at PHOTO_DIRECTORY/<offering>/<sid>.jpg. Uploaded bCourses zips
+are staged to disk and unpacked by several threads, each streaming members
+straight to a temporary file that is renamed into place, so a large zip
+never has to fit in memory and readers never see a half-written photo.
+
+Seating charts show small thumbnails instead of the originals. They are
+stored under PHOTO_DIRECTORY/.thumbnails by the hash of the original, and
+served from signed URLs that name the photo, so serving one needs no
+database lookup. The URLs expire after PHOTO_URL_MAX_AGE seconds, so a
+leaked link doesn't expose a student's photo for good. A room's chart instead uses one sprite sheet of all its
+students' thumbnails, stored under PHOTO_DIRECTORY/.sprites/<exam>/<room>
+by a version hash of the room's layout and which photo sits in which seat.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import zlib
+
+from itsdangerous import BadSignature, TimestampSigner, URLSafeTimedSerializer
+
+from server import app
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow, "thumbnails" are copies of the original photos
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SteppedTimestampSigner(TimestampSigner):
+    # Stamping with the time rounded down to a quarter of the token lifetime
+    # keeps a photo's URL, and so the browser's cached copy, the same for
+    # that long, while every token is still good for at least 3/4 of it
+    def get_timestamp(self):
+        step = max(app.config['PHOTO_URL_MAX_AGE'] // 4, 1)
+        return int(time.time()) // step * step
+
+
+signer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='photo', signer=SteppedTimestampSigner)
+
+# (path, mtime, size) of an original photo -> hash of its contents
+DIGESTS = {}
+
+# WIDTH and HEIGHT are the size of one cell as shown on the chart, which is
+# half the thumbnail size so that photos stay sharp on high-density screens
+Sprite = collections.namedtuple('Sprite', ['version', 'columns', 'rows', 'width', 'height', 'offsets'])
+
+# Room id -> Sprite of its students' photos
+ROOM_SPRITES = {}
+
+
+def photo_path(offering, sid):
+    return os.path.join(app.config['PHOTO_DIRECTORY'], offering, sid + '.jpg')
+
+
+def original_path(offering, bcourses_id):
+    path = os.path.join(app.config['PHOTO_DIRECTORY'], offering, bcourses_id)
+    if os.path.exists(path + '.jpeg'):
+        return path + '.jpeg'
+    return path + '.jpg'
+
+
+def photo_token(offering, bcourses_id):
+    return signer.dumps([offering, bcourses_id])
+
+
+def photo_from_token(token):
+    """Returns the (offering, bcourses_id) signed into TOKEN, or None if it
+    is forged or has expired."""
+    try:
+        offering, bcourses_id = signer.loads(token, max_age=app.config['PHOTO_URL_MAX_AGE'])
+    except (BadSignature, ValueError):
+        return None
+    return offering, bcourses_id
+
+
+def digest(path):
+    """Hashes the photo at PATH (and the thumbnail size), remembering the
+    result until the file changes."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    value = DIGESTS.get(key)
+    if value is None:
+        sha = hashlib.sha1(repr(app.config['THUMBNAIL_SIZE']).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+        value = DIGESTS[key] = sha.hexdigest()
+    return value
+
+
+def make_thumbnail(path, thumbnail_path):
+    directory = os.path.dirname(thumbnail_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.thumbnail-')
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            try:
+                if Image is None:
+                    raise OSError('Pillow is not installed')
+                with Image.open(path) as image:
+                    image.thumbnail(app.config['THUMBNAIL_SIZE'])
+                    image.convert('RGB').save(dst, 'JPEG', quality=85)
+            except OSError:
+                dst.seek(0)
+                dst.truncate()
+                with open(path, 'rb') as src:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.replace(tmp, thumbnail_path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def thumbnail(path):
+    """Returns (thumbnail path, digest) for the photo at PATH, making the
+    thumbnail if it doesn't exist yet. Raises OSError if there's no photo."""
+    value = digest(path)
+    thumbnail_path = os.path.join(app.config['PHOTO_DIRECTORY'], '.thumbnails', value[:2], value + '.jpg')
+    if not os.path.exists(thumbnail_path):
+        make_thumbnail(path, thumbnail_path)
+    return thumbnail_path, value
+
+
+def sprite_path(room, version):
+    return os.path.join(app.config['PHOTO_DIRECTORY'], '.sprites', str(room.exam_id), str(room.id),
+                        version + '.jpg')
+
+
+def make_sprite(path, thumbnails, columns):
+    width, height = app.config['THUMBNAIL_SIZE']
+    rows = -(-len(thumbnails) // columns)
+    sheet = Image.new('RGB', (columns * width, rows * height), 'white')
+    for i, thumbnail_path in enumerate(thumbnails):
+        with Image.open(thumbnail_path) as image:
+            sheet.paste(image, ((i % columns) * width, (i // columns) * height))
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.sprite-')
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            sheet.save(dst, 'JPEG', quality=85)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def room_sprite(room, seat_photos):
+    """Returns the Sprite for ROOM when its occupied seats have the photos in
+    SEAT_PHOTOS, a dict from seat id to original photo path, building its
+    sheet if this seating of this version of the room hasn't been seen
+    before. Seats without a photo are
+    left out of the sprite. Returns None if there is nothing to show or no
+    Pillow to draw it with.
+    """
+    if Image is None:
+        return None
+    digests = {}
+    for seat_id, path in seat_photos.items():
+        try:
+            digests[seat_id] = digest(path)
+        except OSError:
+            pass
+    if not digests:
+        return None
+    seat_ids = sorted(digests)
+    sha = hashlib.sha1('{}\n'.format(room.version).encode())
+    for seat_id in seat_ids:
+        sha.update('{}:{}\n'.format(seat_id, digests[seat_id]).encode())
+    version = sha.hexdigest()
+
+    path = sprite_path(room, version)
+    sprite = ROOM_SPRITES.get(room.id)
+    if sprite and sprite.version == version and os.path.exists(path):
+        return sprite
+    columns = int(len(seat_ids) ** 0.5) or 1
+    rows = -(-len(seat_ids) // columns)
+    if not os.path.exists(path):
+        make_sprite(path, [thumbnail(seat_photos[seat_id])[0] for seat_id in seat_ids], columns)
+    width, height = app.config['THUMBNAIL_SIZE']
+    sprite = ROOM_SPRITES[room.id] = Sprite(version, columns, rows, width // 2, height // 2, {
+        seat_id: (i % columns, i // columns) for i, seat_id in enumerate(seat_ids)
+    })
+    return sprite
+
+
+def photo_members(zf):
+    """Yields (ZipInfo, sid) for each photo in a bCourses roster zip."""
+    for info in zf.infolist():
+        name = info.filename
+        if name.endswith('/'):
+            continue
+        if name.count('/') > 1:
+            continue
+        match = re.search(r'([0-9]+)\.jpe?g', name)
+        if not match:
+            continue
+        yield info, match.group(1)
+
+
+def file_crc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+
+def unchanged(info, path):
+    # The zip already records each member's size and CRC-32, so an existing
+    # photo can be compared without decompressing anything
+    try:
+        if os.path.getsize(path) != info.file_size:
+            return False
+    except OSError:
+        return False
+    return file_crc(path) == info.CRC
+
+
+def extract(zf, info, path):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as dst, zf.open(info) as src:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def ingest_members(zip_path, offering, members):
+    counts = collections.Counter()
+    with zipfile.ZipFile(zip_path) as zf:
+        for info, sid in members:
+            path = photo_path(offering, sid)
+            try:
+                if unchanged(info, path):
+                    counts['unchanged'] += 1
+                    continue
+                extract(zf, info, path)
+                thumbnail(path)
+                counts['saved'] += 1
+            except (OSError, zipfile.BadZipFile, zlib.error):
+                app.logger.exception('Could not save photo %s', info.filename)
+                counts['failed'] += 1
+    return counts
+
+
+def ingest(zip_path, offering, workers=None):
+    """Saves every photo in the zip at ZIP_PATH for OFFERING.
+
+    Members are split between WORKERS threads that each open the zip once.
+    Returns a Counter of photos 'saved', 'unchanged', 'failed', and
+    'skipped' (members that aren't photos).
+    """
+    workers = workers or app.config['PHOTO_WORKERS']
+    with zipfile.ZipFile(zip_path) as zf:
+        # If a zip has two photos for a student, the later one wins
+        members = list(collections.OrderedDict(
+            (sid, (info, sid)) for info, sid in photo_members(zf)
+        ).values())
+        counts = collections.Counter(skipped=len(zf.infolist()) - len(members))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        slices = [members[i::workers] for i in range(workers)]
+        for result in pool.map(lambda s: ingest_members(zip_path, offering, s), slices):
+            counts.update(result)
+    return counts
@@ -1,28 +1,73 @@
+import collections
 import itertools
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
 import re
-import zipfile
+import time
+import uuid
 
 import requests
-import sendgrid
-from flask import abort, redirect, render_template, request, send_file, session, url_for, g
+from flask import abort, escape, jsonify, make_response, redirect, render_template, request, send_file, session, url_for
 from flask_login import current_user
 from flask_wtf import FlaskForm
-from sqlalchemy import func
+from sqlalchemy import and_, func, not_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
 from werkzeug.exceptions import HTTPException
 from werkzeug.routing import BaseConverter
 from werkzeug.utils import secure_filename
-from wtforms import SelectMultipleField, SelectField, StringField, SubmitField, TextAreaField, widgets, FileField
-from wtforms.validators import Email, InputRequired, URL, ValidationError
+from wtforms import SelectMultipleField, SelectField, StringField, SubmitField, TextAreaField, widgets, FileField, FloatField
+from wtforms.validators import Email, InputRequired, NumberRange, Optional, URL, ValidationError
 
-from server import app
-from server.models import Exam, Room, Seat, SeatAssignment, Student, db, slug
+from server import app, assignment, bulk, emails, jobs, metrics, photos
+from server.bulk import SeatRow, StudentRow
+from server.cache import TTLCache
+from server.models import AttributeVocabulary, Exam, Room, Seat, SeatAssignment, Student, db, slug
 
 name_part = '[^/]+'
 
-DOMAIN_COURSES = {}
-COURSE_ENDPOINTS = {}
+MASTER_ROOM_SHEET = 'https://docs.google.com/spreadsheets/d/1cHKVheWv2JnHBorbtfZMW_3Sxj9VtGMmAUU2qGJ33-s/edit?usp=sharing'
+
+# Shared by every call to the auth server so lookups and concurrent sheet
+# imports reuse pooled connections
+auth_session = requests.Session()
+for prefix in ('http://', 'https://'):
+    auth_session.mount(prefix, requests.adapters.HTTPAdapter(pool_maxsize=app.config['SHEET_FETCH_WORKERS']))
+
+
+def auth_cache(fetch, ttl=None, stale=None):
+    return TTLCache(
+        fetch,
+        ttl=app.config['AUTH_CACHE_TTL'] if ttl is None else ttl,
+        negative_ttl=app.config['AUTH_CACHE_NEGATIVE_TTL'],
+        stale=app.config['AUTH_CACHE_STALE'] if stale is None else stale,
+        max_size=app.config['AUTH_CACHE_SIZE'],
+    )
+
+
+def auth_post(path, **kwargs):
+    with metrics.outbound('auth'):
+        response = auth_session.post(app.config['AUTH_SERVER'] + path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+
+# Domain -> course
+DOMAIN_COURSES = auth_cache(lambda domain: auth_post("/domains/get_course", json={
+    "domain": domain
+}))
+# Course -> endpoint
+COURSE_ENDPOINTS = auth_cache(lambda course: auth_post("/api/{}/get_endpoint".format(course)))
+# (email, course) -> whether that user administers the course. Never served
+# stale, so revoked admins lose access within ADMIN_CACHE_TTL seconds
+ADMINS = auth_cache(lambda key: auth_post("/admins/is_admin", json={
+    "email": key[0],
+    "client_name": app.config["AUTH_KEY"],
+    "secret": app.config["AUTH_CLIENT_SECRET"],
+    "course": key[1],
+}), ttl=app.config['ADMIN_CACHE_TTL'], stale=0)
 
 rooms = [('277 Cory', '277 Cory'),
         ('145 Dwinelle', '145 Dwinelle'),
@@ -52,32 +97,19 @@ rooms = [('277 Cory', '277 Cory'),
 def get_course(domain=None):
     if not domain:
         domain = request.headers["HOST"]
-    if domain not in DOMAIN_COURSES:
-        DOMAIN_COURSES[domain] = requests.post("https://auth.apps.cs61a.org/domains/get_course", json={
-            "domain": domain
-        }).json()
-    return DOMAIN_COURSES[domain]
+    return DOMAIN_COURSES.get(domain)
 
 
 def get_endpoint(course=None):
     if not course:
         course = get_course()
-    if course not in COURSE_ENDPOINTS:
-        COURSE_ENDPOINTS[course] = requests.post("https://auth.apps.cs61a.org/api/{}/get_endpoint".format(course)).json()
-    return COURSE_ENDPOINTS[course]
+    return COURSE_ENDPOINTS.get(course)
 
 
 def is_admin(course=None):
     if not course:
         course = get_course()
-    if g.get("is_admin") is None:
-        g.is_admin = requests.post("https://auth.apps.cs61a.org/admins/is_admin", json={
-            "email": current_user.email,
-            "client_name": app.config["AUTH_KEY"],
-            "secret": app.config["AUTH_CLIENT_SECRET"],
-            "course": course,
-        }).json()
-    return g.is_admin
+    return ADMINS.get((current_user.email, course))
 
 
 def format_coursecode(course):
@@ -95,16 +127,50 @@ class Redirect(HTTPException):
         return redirect(self.url)
 
 
+# (offering, name) -> (column values of that exam, time they were read).
+# Every page under an exam resolves it from the URL, so each worker keeps
+# the row for EXAM_CACHE_TTL seconds rather than querying it every request.
+EXAMS = {}
+
+
+def find_exam(offering, name):
+    cached = EXAMS.get((offering, name))
+    if cached and time.time() - cached[1] < app.config['EXAM_CACHE_TTL']:
+        exam = Exam(**cached[0])
+        make_transient_to_detached(exam)
+        return db.session.merge(exam, load=False)
+    exam = Exam.query.filter_by(offering=offering, name=name).first_or_404()
+    EXAMS[offering, name] = ({
+        column.key: getattr(exam, column.key) for column in Exam.__table__.columns
+    }, time.time())
+    return exam
+
+
+def reload_exam(exam):
+    """Re-reads EXAM, which may be a cached copy, for a route about to change
+    it. Returns None if another worker has deleted it."""
+    return Exam.query.populate_existing().filter_by(id=exam.id).first()
+
+
+def forget_exams(offering):
+    """Drops this worker's cached exams for OFFERING after any of them change."""
+    for key in [key for key in EXAMS if key[0] == offering]:
+        EXAMS.pop(key, None)
+
+
+def require_offering(offering):
+    if not current_user.is_authenticated or offering not in current_user.offerings:
+        session['after_login'] = request.url
+        raise Redirect(url_for('login'))
+
+
 class ExamConverter(BaseConverter):
     regex = name_part + '/' + name_part + '/' + name_part + '/' + name_part
 
     def to_python(self, value):
         offering, name = value.rsplit('/', 1)
-        if not current_user.is_authenticated or offering not in current_user.offerings:
-            session['after_login'] = request.url
-            raise Redirect(url_for('login'))
-        exam = Exam.query.filter_by(offering=offering, name=name).first_or_404()
-        return exam
+        require_offering(offering)
+        return find_exam(offering, name)
 
     def to_url(self, exam):
         return exam.offering + '/' + exam.name
@@ -116,9 +182,7 @@ class OfferingConverter(BaseConverter):
     def to_python(self, offering):
         if offering != get_endpoint():
             abort(404)
-        if not current_user.is_authenticated or offering not in current_user.offerings:
-            session['after_login'] = request.url
-            raise Redirect(url_for('login'))
+        require_offering(offering)
         return offering
 
     def to_url(self, offering):
@@ -153,60 +217,74 @@ class MultRoomForm(FlaskForm):
 
 def read_csv(sheet_url, sheet_range):
     try:
-        values = requests.post("https://auth.apps.cs61a.org/google/read_spreadsheet", json={
-            "url": sheet_url,
-            "sheet_name": sheet_range,
-            "course": "cs61a",
-            "client_name": app.config["AUTH_KEY"],
-            "secret": app.config["AUTH_CLIENT_SECRET"],
-        }).json()
+        with metrics.outbound('sheets'):
+            values = auth_session.post(app.config['SHEETS_URL'], json={
+                "url": sheet_url,
+                "sheet_name": sheet_range,
+                "course": "cs61a",
+                "client_name": app.config["AUTH_KEY"],
+                "secret": app.config["AUTH_CLIENT_SECRET"],
+            }).json()
     except:
         raise ValidationError('Could not reach Google Sheet. Please make sure your sheet is shared with secure-links@ok-server.iam.gserviceaccount.com')
 
-    if not values:
+    headers, rows = sheet_rows(values)
+    return headers, list(rows)
+
+
+def sheet_rows(values):
+    """Splits sheet VALUES, an iterable of rows, into lowercase headers and
+    an iterator of dicts from header to cell, read as they are needed."""
+    values = iter(values or [])
+    headers = [h.lower() for h in next(values, [])]
+    if not headers:
         raise ValidationError('Sheet is empty')
-    headers = [h.lower() for h in values[0]]
-    rows = [
-        {k: v for k, v in itertools.zip_longest(headers, row, fillvalue='')}
-        for row in values[1:]
-    ]
-    if len(set(headers)) != len(headers):
+    elif len(set(headers)) != len(headers):
         raise ValidationError('Headers must be unique')
     elif not all(re.match(r'[a-z0-9]+', h) for h in headers):
         raise ValidationError('Headers must consist of digits and numbers')
+    rows = (
+        {k: v for k, v in itertools.zip_longest(headers, row, fillvalue='')}
+        for row in values
+    )
     return headers, rows
 
 
-def validate_room(exam, room_form):
-    room = Room(
-        exam_id=exam.id,
-        name=slug(room_form.display_name.data),
-        display_name=room_form.display_name.data,
-    )
-    existing_room = Room.query.filter_by(exam_id=exam.id, name=room.name).first()
-    if existing_room:
-        raise ValidationError('A room with that name already exists')
-    headers, rows = read_csv(room_form.sheet_url.data, room_form.sheet_range.data)
+def read_csvs(sheets):
+    """Reads every (sheet_url, sheet_range) in SHEETS concurrently.
+
+    Yields (sheet, future) pairs in the order the sheets arrive; each future
+    holds the result of read_csv or the ValidationError it raised.
+    """
+    workers = max(min(app.config['SHEET_FETCH_WORKERS'], len(sheets)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(read_csv, *sheet): sheet for sheet in sheets}
+        for future in as_completed(futures):
+            yield futures[future], future
+
+
+def parse_seats(headers, rows):
+    """Validates sheet ROWS into a list of SeatRows, without touching the DB."""
     if 'row' not in headers:
         raise ValidationError('Missing "row" column')
     elif 'seat' not in headers:
         raise ValidationError('Missing "seat" column')
 
+    seats = []
     x, y = 0, -1
     last_row = None
     for row in rows:
-        seat = Seat()
-        seat.row = row.pop('row')
-        seat.seat = row.pop('seat')
-        seat.name = seat.row + seat.seat
-        if not seat.name:
+        seat_row = row.pop('row')
+        seat_seat = row.pop('seat')
+        name = seat_row + seat_seat
+        if not name:
             continue
-        if seat.row != last_row:
+        if seat_row != last_row:
             x = 0
             y += 1
         else:
             x += 1
-        last_row = seat.row
+        last_row = seat_row
         x_override = row.pop('x', None)
         y_override = row.pop('y', None)
         try:
@@ -214,16 +292,39 @@ def validate_room(exam, room_form):
                 x = float(x_override)
             if y_override:
                 y = float(y_override)
-        except TypeError:
+        except (TypeError, ValueError):
             raise ValidationError('xy coordinates must be floats')
-        seat.x = x
-        seat.y = y
-        seat.attributes = {k for k, v in row.items() if v.lower() == 'true'}
-        room.seats.append(seat)
-    if len(set(seat.name for seat in room.seats)) != len(room.seats):
+        attributes = {k for k, v in row.items() if v.lower() == 'true'}
+        seats.append(SeatRow(name, seat_row, seat_seat, x, y, attributes))
+    if len(set(seat.name for seat in seats)) != len(seats):
         raise ValidationError('Seats are not unique')
-    elif len(set((seat.x, seat.y) for seat in room.seats)) != len(room.seats):
+    elif len(set((seat.x, seat.y) for seat in seats)) != len(seats):
         raise ValidationError('Seat coordinates are not unique')
+    return seats
+
+
+def new_exam_room(exam, display_name):
+    room = Room(
+        exam_id=exam.id,
+        name=slug(display_name),
+        display_name=display_name,
+    )
+    existing_room = Room.query.filter_by(exam_id=exam.id, name=room.name).first()
+    if existing_room:
+        raise ValidationError('A room with that name already exists')
+    return room
+
+
+def validate_room(exam, room_form):
+    """Returns a new Room (without seats) and its validated SeatRows."""
+    room = new_exam_room(exam, room_form.display_name.data)
+    headers, rows = read_csv(room_form.sheet_url.data, room_form.sheet_range.data)
+    return room, parse_seats(headers, rows)
+
+
+def preview_room(room, seats):
+    """Attaches transient Seat objects to ROOM so it can be rendered."""
+    room.seats = [Seat(**seat._asdict()) for seat in seats]
     return room
 
 
@@ -241,13 +342,15 @@ def new_room(exam):
     room = None
     if new_form.validate_on_submit():
         try:
-            room = validate_room(exam, new_form)
-        except ValidationError as e:
+            room, seats = validate_room(exam, new_form)
+            if new_form.create_room.data:
+                bulk.insert_rooms([(room, seats)])
+                return redirect(url_for('exam', exam=exam))
+        except (ValidationError, ValueError) as e:
             new_form.sheet_url.errors.append(str(e))
-        if new_form.create_room.data:
-            db.session.add(room)
-            db.session.commit()
-            return redirect(url_for('exam', exam=exam))
+            room = None
+        else:
+            preview_room(room, seats)
     return render_template('new_room.html.j2', exam=exam, new_form=new_form, choose_form=choose_form, room=room)
 
 
@@ -256,18 +359,31 @@ def mult_new_room(exam):
     new_form = RoomForm()
     choose_form = MultRoomForm()
     if choose_form.validate_on_submit():
-        for r in choose_form.rooms.data:
-            # add error handling
-            f = RoomForm(display_name=r,
-                         sheet_url='https://docs.google.com/spreadsheets/d/1cHKVheWv2JnHBorbtfZMW_3Sxj9VtGMmAUU2qGJ33-s/edit?usp=sharing',
-                         sheet_range=r)
-            room = validate_room(exam, f)
-            db.session.add(room)
-            db.session.commit()
-        return redirect(url_for('exam', exam=exam))
+        jobs.enqueue(exam, 'import_rooms', rooms=choose_form.rooms.data)
+        return redirect(url_for('exam_jobs', exam=exam))
     return render_template('new_room.html.j2', exam=exam, new_form=new_form, choose_form=choose_form)
 
 
+@jobs.handler('import_rooms')
+def import_rooms(job, exam, rooms):
+    # Sheets are fetched in parallel; each room is validated and inserted
+    # on its own as soon as it arrives, so one bad sheet doesn't stop the rest
+    results = []
+    sheets = [(MASTER_ROOM_SHEET, r) for r in rooms]
+    for (_, display_name), future in read_csvs(sheets):
+        try:
+            room = new_exam_room(exam, display_name)
+            headers, rows = future.result()
+            bulk.insert_rooms([(room, parse_seats(headers, rows))])
+        except (ValidationError, ValueError, SQLAlchemyError) as e:
+            db.session.rollback()
+            results.append('{}: {}'.format(display_name, e))
+        else:
+            results.append('{}: imported'.format(display_name))
+        jobs.report(job, len(results), len(rooms))
+    return '\n'.join(sorted(results))
+
+
 @app.route('/<exam:exam>/rooms/update/<room_name>/', methods=['POST'])
 def update_room(exam, room_name):
     # ask if want to delete
@@ -285,13 +401,9 @@ def delete_room(exam, room_name):
     # if assigned ask if they are sure they want to delete seat assignments
     room = Room.query.filter_by(exam_id=exam.id, name=room_name).first()
     if room:
-        seats = Seat.query.filter_by(room_id=room.id).all()
-        for seat in seats:
-            if seat.assignment:
-                db.session.delete(seat.assignment)
-            db.session.delete(seat)
-        db.session.delete(room)
-        db.session.commit()
+        drop_public_chart(room.id)
+        photos.ROOM_SPRITES.pop(room.id, None)
+        bulk.delete_room(room)
     return render_template('exam.html.j2', exam=exam)
 
 
@@ -301,8 +413,8 @@ class StudentForm(FlaskForm):
     submit = SubmitField('import')
 
 
-def validate_students(exam, form):
-    headers, rows = read_csv(form.sheet_url.data, form.sheet_range.data)
+def parse_students(headers, rows):
+    """Validates sheet ROWS into a list of StudentRows, without touching the DB."""
     if 'email' not in headers:
         raise ValidationError('Missing "email" column')
     elif 'name' not in headers:
@@ -312,30 +424,31 @@ def validate_students(exam, form):
         email = row.pop('email')
         if not email:
             continue
-        student = Student.query.filter_by(exam_id=exam.id, email=email).first()
-        if not student:
-            student = Student(exam_id=exam.id, email=email)
-        student.name = row.pop('name')
-        student.sid = row.pop('student id', None) or student.sid
-        student.bcourses_id = row.pop('bcourses id', None) or student.bcourses_id
-        student.wants = {k for k, v in row.items() if v.lower() == 'true'}
-        student.avoids = {k for k, v in row.items() if v.lower() == 'false'}
-        students.append(student)
+        name = row.pop('name')
+        sid = row.pop('student id', None) or None
+        bcourses_id = row.pop('bcourses id', None) or None
+        wants = {k for k, v in row.items() if v.lower() == 'true'}
+        avoids = {k for k, v in row.items() if v.lower() == 'false'}
+        students.append(StudentRow(email, name, sid, bcourses_id, wants, avoids))
     return students
 
 
+def validate_students(exam, form):
+    headers, rows = read_csv(form.sheet_url.data, form.sheet_range.data)
+    return parse_students(headers, rows)
+
+
 @app.route('/<exam:exam>/students/import/', methods=['GET', 'POST'])
 def new_students(exam):
     form = StudentForm()
+    counts = None
     if form.validate_on_submit():
         try:
             students = validate_students(exam, form)
-            db.session.add_all(students)
-            db.session.commit()
-            return redirect(url_for('exam', exam=exam))
-        except ValidationError as e:
+            counts = bulk.upsert_students(exam, students)
+        except (ValidationError, ValueError) as e:
             form.sheet_url.errors.append(str(e))
-    return render_template('new_students.html.j2', exam=exam, form=form)
+    return render_template('new_students.html.j2', exam=exam, form=form, counts=counts)
 
 
 class DeleteStudentForm(FlaskForm):
@@ -348,93 +461,426 @@ def delete_students(exam):
     form = DeleteStudentForm()
     deleted, did_not_exist = set(), set()
     if form.validate_on_submit():
-        for email in re.split(r'\s|,', form.emails.data):
-            if not email:
-                continue
-            student = Student.query.filter_by(exam_id=exam.id, email=email).first()
-            if student:
-                deleted.add(email)
-                if student.assignment:
-                    db.session.delete(student.assignment)
-                db.session.delete(student)
-            else:
-                did_not_exist.add(email)
-        db.session.commit()
+        deleted, did_not_exist = bulk.delete_students(exam, re.split(r'\s|,', form.emails.data))
     return render_template('delete_students.html.j2',
                            exam=exam, form=form, deleted=deleted, did_not_exist=did_not_exist)
 
 
+# Targets offered by the room planner, as the most of a room's seats to fill
+ROOM_UTILIZATIONS = (1, 0.9, 0.8, 0.7)
+
+
+INCREMENTAL_UTILIZATION = '"Keep existing seats" leaves students where they are, so it can only use every room'
+
+
+ASSIGN_MODES = [
+    ('greedy', 'Most restrictive first'),
+    ('matching', 'Optimal matching'),
+    ('incremental', 'Keep existing seats'),
+    ('spaced', 'Spread out'),
+]
+
+
 class AssignForm(FlaskForm):
+    mode = SelectField('mode', choices=ASSIGN_MODES, default='greedy')
+    spacing = FloatField('spacing', [Optional(), NumberRange(min=0)], default=2)
+    utilization = SelectField('utilization', choices=[('', 'Every room')] + [
+        (str(utilization), 'Fewest rooms, filled to {:.0%}'.format(utilization))
+        for utilization in ROOM_UTILIZATIONS
+    ], default='')
     submit = SubmitField('assign')
 
 
-def collect(s, key=lambda x: x):
-    d = {}
-    for x in s:
-        k = key(x)
-        if k in d:
-            d[k].append(x)
+# Just what assignment needs, decoded from the attribute masks rather than
+# loading every Student and Seat
+StudentPreferences = collections.namedtuple('StudentPreferences', ['id', 'wants', 'avoids'])
+SeatAttributes = collections.namedtuple('SeatAttributes', ['id', 'room_id', 'x', 'y', 'attributes'])
+
+
+def preference_supply(exam):
+    """Counts, in SQL, the free seats that suit each group of unassigned
+    students of EXAM with the same preferences.
+
+    Returns a list of (wants, avoids, students, seats).
+    """
+    vocabulary = AttributeVocabulary(exam.id)
+    groups = db.session.query(
+        Student.wants_mask.label('wants'),
+        Student.avoids_mask.label('avoids'),
+        func.count(Student.id).label('students'),
+    ).filter(
+        Student.exam_id == exam.id,
+        Student.assignment == None,
+    ).group_by(Student.wants_mask, Student.avoids_mask).subquery()
+    free = db.session.query(Seat.id, Seat.attribute_mask).join(Seat.room).filter(
+        Room.exam_id == exam.id,
+        Seat.assignment == None,
+    ).subquery()
+    rows = db.session.query(
+        groups.c.wants, groups.c.avoids, groups.c.students, func.count(free.c.id),
+    ).outerjoin(free, and_(
+        free.c.attribute_mask.op('&')(groups.c.wants) == groups.c.wants,
+        free.c.attribute_mask.op('&')(groups.c.avoids) == 0,
+    )).group_by(groups.c.wants, groups.c.avoids, groups.c.students)
+    return [
+        (vocabulary.decode(wants), vocabulary.decode(avoids), students, seats)
+        for wants, avoids, students, seats in rows
+    ]
+
+
+def student_demand(exam, vocabulary):
+    """Counts, in SQL, the unassigned students of EXAM by preferences."""
+    return {
+        (vocabulary.decode(wants), vocabulary.decode(avoids)): students
+        for wants, avoids, students in db.session.query(
+            Student.wants_mask, Student.avoids_mask, func.count(Student.id),
+        ).filter(
+            Student.exam_id == exam.id,
+            Student.assignment == None,
+        ).group_by(Student.wants_mask, Student.avoids_mask)
+    }
+
+
+def room_capacities(exam, vocabulary):
+    """Counts, in SQL, the free seats of each room of EXAM by attributes.
+
+    Returns a dict from room id to a dict from attributes to seats.
+    """
+    rooms = {room_id: {} for room_id, in db.session.query(Room.id).filter(Room.exam_id == exam.id)}
+    for room_id, mask, seats in db.session.query(
+        Seat.room_id, Seat.attribute_mask, func.count(Seat.id),
+    ).join(Seat.room).filter(
+        Room.exam_id == exam.id,
+        Seat.assignment == None,
+    ).group_by(Seat.room_id, Seat.attribute_mask):
+        rooms[room_id][vocabulary.decode(mask)] = seats
+    return rooms
+
+
+def assigned_counts(exam):
+    """Counts, in SQL, the assigned seats of each room of EXAM."""
+    return dict(db.session.query(Seat.room_id, func.count(SeatAssignment.seat_id)).join(
+        SeatAssignment.seat,
+    ).join(Seat.room).filter(Room.exam_id == exam.id).group_by(Seat.room_id))
+
+
+def room_limits(exam, capacities, utilization):
+    """How many more students each room of EXAM can take, given its free
+    seats in CAPACITIES, before more than UTILIZATION of its seats are used."""
+    assigned = assigned_counts(exam)
+    limits = {}
+    for room_id, classes in capacities.items():
+        free = sum(classes.values())
+        total = free + assigned.get(room_id, 0)
+        # Rounded to hide float error, e.g. 0.7 * 10 = 7.000000000000001
+        allowed = math.floor(round(total * utilization, 6)) - assigned.get(room_id, 0)
+        limits[room_id] = max(0, min(free, allowed))
+    return limits
+
+
+def assignment_report(exam):
+    """Reports whether the unassigned students of EXAM fit in its free seats,
+    from SQL counts alone and without running or saving an assignment.
+
+    Returns a dict with the total students and free seats, how many could be
+    seated, the students and suitable seats of each preference, each room's
+    expected fill if students are spread over every room, and the shortages
+    that make a complete assignment impossible (empty if there are none).
+    """
+    vocabulary = AttributeVocabulary(exam.id)
+    demand = student_demand(exam, vocabulary)
+    capacities = room_capacities(exam, vocabulary)
+    classes = collections.Counter()
+    for room_classes in capacities.values():
+        classes.update(room_classes)
+    seated, shortages = assignment.seatable(demand, classes)
+    students, seats = sum(demand.values()), sum(classes.values())
+    assigned = assigned_counts(exam)
+    rooms = []
+    for room in exam.rooms:
+        free = sum(capacities[room.id].values())
+        total = free + assigned.get(room.id, 0)
+        expected = assigned.get(room.id, 0) + (students * free / seats if seats else 0)
+        rooms.append({
+            'room': room.display_name,
+            'seats': total,
+            'assigned': assigned.get(room.id, 0),
+            'expected': round(expected),
+            'utilization': round(expected / total, 3) if total else 0,
+        })
+    return {
+        'students': students,
+        'seats': seats,
+        'seated': seated,
+        'preferences': [
+            {'preference': assignment.describe((wants, avoids)), 'students': count, 'seats': supply}
+            for wants, avoids, count, supply in sorted(preference_supply(exam), key=lambda p: (p[3] - p[2], p[3]))
+        ],
+        'rooms': rooms,
+        'shortages': [
+            {'preference': assignment.describe(preference), 'students': count, 'seats': supply}
+            for preference, count, supply in shortages
+        ],
+    }
+
+
+RoomPlan = collections.namedtuple('RoomPlan', ['utilization', 'rooms', 'seats', 'limits'])
+
+
+def plan_rooms(exam, utilizations=ROOM_UTILIZATIONS):
+    """Returns (students, RoomPlans) for seating the unassigned students of
+    EXAM at each target utilization, which no room may go over. A plan's
+    rooms are None if it can't be met, and its limits map each room id to
+    how many more students that room may take."""
+    vocabulary = AttributeVocabulary(exam.id)
+    demand = student_demand(exam, vocabulary)
+    capacities = room_capacities(exam, vocabulary)
+    rooms = {room.id: room for room in exam.rooms}
+    plans = []
+    for utilization in utilizations:
+        limits = room_limits(exam, capacities, utilization)
+        room_ids = assignment.plan_rooms(demand, capacities, limits)
+        if room_ids is None:
+            plans.append(RoomPlan(utilization, None, 0, limits))
         else:
-            d[k] = [x]
-    return d
+            plans.append(RoomPlan(utilization, [rooms[r] for r in room_ids], sum(
+                sum(capacities[r].values()) for r in room_ids
+            ), limits))
+    return sum(demand.values()), plans
+
+
+def occupied_seats(exam):
+    return [
+        SeatAttributes(id, room_id, x, y, frozenset())
+        for id, room_id, x, y in db.session.query(
+            Seat.id, Seat.room_id, Seat.x, Seat.y,
+        ).join(Seat.room).filter(
+            Room.exam_id == exam.id,
+            Seat.assignment != None,
+        )
+    ]
 
 
-def assign_students(exam):
+def assign_students(exam, seed=None, mode='greedy', spacing=2, rooms=None, limits=None):
     """The strategy: look for students whose requirements are the most
     restrictive (i.e. have the fewest possible seats). Randomly assign them
     a seat. Repeat.
+
+    Seats are indexed by attribute once up front (see server.assignment), so
+    this runs in near-linear time in the number of students and seats.
+
+    With mode='matching', solve for a complete assignment instead, which
+    succeeds whenever one exists even if the greedy order would fail. With
+    mode='spaced', keep students SPACING seats apart where there's room.
+    With ROOMS, a list of room ids, only seat students in those rooms, and
+    with LIMITS, a dict from room id to a number, seat at most that many
+    students in each room.
     """
-    students = set(Student.query.filter_by(
-        exam_id=exam.id, assignment=None
-    ).all())
-    seats = set(Seat.query.join(Seat.room).filter(
+    vocabulary = AttributeVocabulary(exam.id)
+    students = [
+        StudentPreferences(id, vocabulary.decode(wants), vocabulary.decode(avoids))
+        for id, wants, avoids in db.session.query(
+            Student.id, Student.wants_mask, Student.avoids_mask,
+        ).filter(
+            Student.exam_id == exam.id,
+            Student.assignment == None,
+        )
+    ]
+    seats = db.session.query(
+        Seat.id, Seat.room_id, Seat.x, Seat.y, Seat.attribute_mask,
+    ).join(Seat.room).filter(
         Room.exam_id == exam.id,
         Seat.assignment == None,
-    ).all())
+    )
+    if rooms is not None:
+        seats = seats.filter(Seat.room_id.in_(rooms))
+    seats = [
+        SeatAttributes(id, room_id, x, y, vocabulary.decode(mask))
+        for id, room_id, x, y, mask in seats
+    ]
 
-    def seats_available(preference):
-        wants, avoids = preference
-        return [
-            seat for seat in seats
-            if all(a in seat.attributes for a in wants)
-               and all(a not in seat.attributes for a in avoids)
-        ]
+    try:
+        if limits is not None:
+            seats = assignment.capped_seats(students, seats, limits)
+        if mode == 'matching':
+            pairs = assignment.match(students, seats, rng=random.Random(seed))
+        elif mode == 'spaced':
+            pairs = assignment.spread(students, seats, spacing, occupied_seats(exam), rng=random.Random(seed))
+        else:
+            pairs = assignment.assign(students, seats, rng=random.Random(seed))
+    except assignment.AssignmentFailed as e:
+        return str(e)
+    return [SeatAssignment(student_id=student.id, seat_id=seat.id) for student, seat in pairs]
 
-    assignments = []
-    while students:
-        students_by_preference = collect(students, key=
-        lambda student: (frozenset(student.wants), frozenset(student.avoids)))
-        seats_by_preference = {
-            preference: seats_available(preference)
-            for preference in students_by_preference
-        }
-        min_preference = min(seats_by_preference, key=lambda k: len(seats_by_preference[k]))
-        min_students = students_by_preference[min_preference]
-        min_seats = seats_by_preference[min_preference]
-        if not min_seats:
-            return 'Assignment failed! No more seats for preference {}'.format(min_preference)
 
-        student = random.choice(min_students)
-        seat = random.choice(min_seats)
+def reassign_students(exam, seed=None):
+    """Seats every unassigned student of EXAM and reseats students whose
+    seat no longer suits their preferences, keeping everyone else where
+    they are unless moving them is the only way to fit the rest.
+
+    Students who stay put are only counted, in SQL, by their preferences
+    and seat attributes; rows are loaded just for the students who need a
+    seat, the free seats, and whoever rematch() decides to move.
+
+    Returns (new SeatAssignments, ids of students whose old assignment must
+    be deleted), or an error string.
+    """
+    rng = random.Random(seed)
+    vocabulary = AttributeVocabulary(exam.id)
+    suited = and_(
+        Seat.attribute_mask.op('&')(Student.wants_mask) == Student.wants_mask,
+        Seat.attribute_mask.op('&')(Student.avoids_mask) == 0,
+    )
+
+    def seated():
+        return db.session.query(
+            Student.id, Student.wants_mask, Student.avoids_mask,
+            Seat.id, Seat.room_id, Seat.x, Seat.y, Seat.attribute_mask,
+        ).select_from(SeatAssignment).join(SeatAssignment.student).join(SeatAssignment.seat).filter(
+            Student.exam_id == exam.id,
+        )
 
-        students.remove(student)
-        seats.remove(seat)
+    def pairs_of(rows):
+        return [
+            (
+                StudentPreferences(student_id, vocabulary.decode(wants), vocabulary.decode(avoids)),
+                SeatAttributes(seat_id, room_id, x, y, vocabulary.decode(mask)),
+            )
+            for student_id, wants, avoids, seat_id, room_id, x, y, mask in rows
+        ]
+
+    kept, masks = {}, {}
+    for wants, avoids, mask, count in db.session.query(
+        Student.wants_mask, Student.avoids_mask, Seat.attribute_mask, func.count(Student.id),
+    ).select_from(SeatAssignment).join(SeatAssignment.student).join(SeatAssignment.seat).filter(
+        Student.exam_id == exam.id,
+        suited,
+    ).group_by(Student.wants_mask, Student.avoids_mask, Seat.attribute_mask):
+        key = ((vocabulary.decode(wants), vocabulary.decode(avoids)), vocabulary.decode(mask))
+        kept[key] = count
+        masks[key] = (wants, avoids, mask)
+
+    def pick(preference, attributes, count):
+        # Any COUNT of the students in this group and kind of seat will do,
+        # so take a run of them from a random offset rather than load them all
+        wants, avoids, mask = masks[preference, attributes]
+        return pairs_of(seated().filter(
+            Student.wants_mask == wants,
+            Student.avoids_mask == avoids,
+            Seat.attribute_mask == mask,
+        ).order_by(Student.id).offset(rng.randrange(kept[preference, attributes] - count + 1)).limit(count))
+
+    unsuited = pairs_of(seated().filter(not_(suited)))
+    students = [student for student, _ in unsuited] + [
+        StudentPreferences(id, vocabulary.decode(wants), vocabulary.decode(avoids))
+        for id, wants, avoids in db.session.query(
+            Student.id, Student.wants_mask, Student.avoids_mask,
+        ).filter(
+            Student.exam_id == exam.id,
+            Student.assignment == None,
+        )
+    ]
+    seats = [seat for _, seat in unsuited] + [
+        SeatAttributes(id, room_id, x, y, vocabulary.decode(mask))
+        for id, room_id, x, y, mask in db.session.query(
+            Seat.id, Seat.room_id, Seat.x, Seat.y, Seat.attribute_mask,
+        ).join(Seat.room).filter(
+            Room.exam_id == exam.id,
+            Seat.assignment == None,
+        )
+    ]
 
-        assignments.append(SeatAssignment(student=student, seat=seat))
-    return assignments
+    try:
+        pairs, moved = assignment.rematch(kept, students, seats, pick, rng=rng)
+    except assignment.AssignmentFailed as e:
+        return str(e)
+    return [SeatAssignment(student_id=student.id, seat_id=seat.id) for student, seat in pairs], \
+        [student.id for student, _ in unsuited] + [student.id for student in moved]
 
 
 @app.route('/<exam:exam>/students/assign/', methods=['GET', 'POST'])
 def assign(exam):
     form = AssignForm()
     if form.validate_on_submit():
-        assignments = assign_students(exam)
-        if type(assignments) == str:
-            return assignments
+        if form.mode.data == 'incremental' and form.utilization.data:
+            form.utilization.errors.append(INCREMENTAL_UTILIZATION)
+        else:
+            # Spacing is only used by "Spread out", and may be left blank otherwise
+            spacing = 2 if form.spacing.data is None else form.spacing.data
+            jobs.enqueue(exam, 'assign', mode=form.mode.data, spacing=spacing,
+                         utilization=form.utilization.data)
+            return redirect(url_for('exam_jobs', exam=exam))
+    students, plans = plan_rooms(exam)
+    return render_template('assign.html.j2', exam=exam, form=form, students=students, plans=plans,
+                           report=assignment_report(exam))
+
+
+def dry_run(exam, mode, spacing=2):
+    """Runs assignment MODE for EXAM in memory and rolls it back. Returns the
+    SeatAssignments it would add, or an error string."""
+    if mode == 'incremental':
+        result = reassign_students(exam)
+        if type(result) != str:
+            result = result[0]
+    else:
+        result = assign_students(exam, mode=mode, spacing=spacing)
+    db.session.rollback()
+    return result
+
+
+@app.route('/<exam:exam>/students/assign/preview/')
+def assign_preview(exam):
+    """A dry run of assignment. With ?mode=, also runs that mode in memory
+    and reports whether it succeeds, without saving anything."""
+    report = assignment_report(exam)
+    mode = request.args.get('mode')
+    if mode:
+        if mode not in dict(ASSIGN_MODES):
+            abort(400)
+        start = time.time()
+        result = dry_run(exam, mode, spacing=request.args.get('spacing', 2, type=float))
+        report['run'] = {
+            'mode': mode,
+            'seconds': round(time.time() - start, 3),
+            'assigned': 0 if type(result) == str else len(result),
+            'error': result if type(result) == str else None,
+        }
+    return jsonify(report)
+
+
+@jobs.handler('assign')
+def assign_job(job, exam, mode, spacing=2, utilization=None):
+    if mode == 'incremental' and utilization:
+        raise ValidationError(INCREMENTAL_UTILIZATION)
+    if mode == 'incremental':
+        result = reassign_students(exam)
+        if type(result) == str:
+            raise ValidationError(result)
+        # Only the new and moved rows start out unemailed
+        assignments, moved = result
+        if moved:
+            SeatAssignment.query.filter(
+                SeatAssignment.student_id.in_(moved),
+            ).delete(synchronize_session=False)
         db.session.add_all(assignments)
         db.session.commit()
-        return redirect(url_for('students', exam=exam))
-    return render_template('assign.html.j2', exam=exam, form=form)
+        return 'Assigned {} students, {} of whom moved seats'.format(len(assignments), len(moved))
+    rooms = limits = None
+    if utilization:
+        _, (plan,) = plan_rooms(exam, [float(utilization)])
+        if plan.rooms is None:
+            raise ValidationError('Not enough seats to fill rooms to {:.0%}'.format(float(utilization)))
+        rooms, limits = [room.id for room in plan.rooms], plan.limits
+    assignments = assign_students(exam, mode=mode, spacing=spacing, rooms=rooms, limits=limits)
+    if type(assignments) == str:
+        raise ValidationError(assignments)
+    db.session.add_all(assignments)
+    db.session.commit()
+    if mode == 'spaced':
+        crowded = assignment.crowded_count(occupied_seats(exam), spacing)
+        return 'Assigned {} students; {} sit closer than {} seats to a neighbor'.format(
+            len(assignments), crowded, spacing)
+    return 'Assigned {} students'.format(len(assignments))
 
 
 class EmailForm(FlaskForm):
@@ -446,81 +892,44 @@ class EmailForm(FlaskForm):
     submit = SubmitField('send')
 
 
-def email_students(exam, form):
-    """Emails students in batches of 900"""
-    sg = sendgrid.SendGridAPIClient(api_key=app.config['SENDGRID_API_KEY'])
-    test = form.test_email.data
-    while True:
-        limit = 1 if test else 900
-        assignments = SeatAssignment.query.join(SeatAssignment.seat).join(Seat.room).filter(
-            Room.exam_id == exam.id,
-            SeatAssignment.emailed == False,
-        ).limit(limit).all()
-        if not assignments:
-            break
-
-        data = {
-            'personalizations': [
-                {
-                    'to': [
-                        {
-                            'email': test if test else assignment.student.email,
-                        }
-                    ],
-                    'substitutions': {
-                        '-name-': assignment.student.first_name,
-                        '-room-': assignment.seat.room.display_name,
-                        '-seat-': assignment.seat.name,
-                        '-seatid-': str(assignment.seat.id),
-                    },
-                }
-                for assignment in assignments
-            ],
-            'from': {
-                'email': form.from_email.data,
-                'name': form.from_name.data,
-            },
-            'subject': form.subject.data,
-            'content': [
-                {
-                    'type': 'text/plain',
-                    'value': '''
-Hi -name-,
-
-Here's your assigned seat for {}:
-
-Room: -room-
-
-Seat: -seat-
-
-You can view this seat's position on the seating chart at:
-{}/seat/-seatid-/
-
-{}
-'''.format(exam.display_name, request.url_root, form.additional_text.data)
-                },
-            ],
-        }
-
-        response = sg.client.mail.send.post(request_body=data)
-        if response.status_code < 200 or response.status_code >= 400:
-            raise Exception('Could not send mail. Status: {}. Body: {}'.format(
-                response.status_code, response.body
-            ))
-        if test:
-            return
-        for assignment in assignments:
-            assignment.emailed = True
-        db.session.commit()
+def email_message(form):
+    return {
+        'from': {
+            'email': form.from_email.data,
+            'name': form.from_name.data,
+        },
+        'subject': form.subject.data,
+        'additional_text': form.additional_text.data,
+    }
 
 
 @app.route('/<exam:exam>/students/email/', methods=['GET', 'POST'])
 def email(exam):
     form = EmailForm()
     if form.validate_on_submit():
-        email_students(exam, form)
-        return redirect(url_for('students', exam=exam))
-    return render_template('email.html.j2', exam=exam, form=form)
+        if form.test_email.data:
+            emails.email_students(exam, email_message(form), request.url_root, test=form.test_email.data)
+            return redirect(url_for('students', exam=exam))
+        jobs.enqueue(exam, 'email', message=email_message(form), root_url=request.url_root)
+        return redirect(url_for('exam_jobs', exam=exam))
+    emailed, total = emails.progress(exam)
+    return render_template('email.html.j2', exam=exam, form=form, emailed=emailed, total=total)
+
+
+@jobs.handler('email')
+def email_job(job, exam, message, root_url):
+    """Emails students in concurrent batches of 900 (see server.emails)"""
+    emailed, total = emails.progress(exam)
+    jobs.report(job, 0, total - emailed)
+    sent = emails.email_students(exam, message, root_url,
+                                 on_progress=lambda sent: jobs.report(job, sent))
+    return 'Emailed {} students'.format(sent)
+
+
+@app.route('/<exam:exam>/students/email/progress/')
+def email_progress(exam):
+    emailed, total = emails.progress(exam)
+    return jsonify(emailed=emailed, total=total)
 
 
 @app.route("/")
@@ -536,6 +945,19 @@ def offering(offering):
     return render_template("offering.j2", title="{} Exam Seating".format(format_coursecode(get_course())), exams=exams, offering=offering, is_admin=is_admin())
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    if app.instrumentation is None:
+        abort(404)
+    token = app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == 'Bearer ' + token):
+        if not current_user.is_authenticated or not is_admin():
+            abort(403)
+    response = make_response(metrics.registry.exposition())
+    response.mimetype = 'text/plain'
+    return response
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_file('static/img/favicon.ico')
@@ -564,6 +986,7 @@ def new_exam(offering):
         exam = Exam(offering=offering, name=form.name.data, display_name=form.display_name.data, is_active=True)
         db.session.add(exam)
         db.session.commit()
+        forget_exams(offering)
 
         return redirect(url_for("offering", offering=offering))
     return render_template("new_exam.html.j2", title="{} Exam Seating".format(format_coursecode(get_course())), form=form)
@@ -571,20 +994,30 @@ def new_exam(offering):
 
 @app.route("/<exam:exam>/delete/", methods=["GET", "POST"])
 def delete_exam(exam):
-    db.session.delete(exam)
-    db.session.commit()
+    offering = exam.offering
+    exam = reload_exam(exam)
+    if exam:
+        db.session.delete(exam)
+        db.session.commit()
+    forget_exams(offering)
 
-    return redirect(url_for("offering", offering=exam.offering))
+    return redirect(url_for("offering", offering=offering))
 
 
 @app.route("/<exam:exam>/toggle/", methods=["GET", "POST"])
 def toggle_exam(exam):
+    offering = exam.offering
+    exam = reload_exam(exam)
+    if not exam:
+        forget_exams(offering)
+        abort(404)
     if exam.is_active:
         exam.is_active = False
     else:
         Exam.query.filter_by(offering=exam.offering).update({"is_active": False})
         exam.is_active = True
     db.session.commit()
+    forget_exams(exam.offering)
     return redirect(url_for("offering", offering=exam.offering))
 
 @app.route('/<exam:exam>/')
@@ -592,6 +1025,26 @@ def exam(exam):
     return render_template('exam.html.j2', exam=exam, is_admin=is_admin())
 
 
+@app.route('/<exam:exam>/jobs/')
+def exam_jobs(exam):
+    recent = exam.jobs.limit(20).all()
+    return render_template('jobs.html.j2', exam=exam, jobs=recent,
+                           running=not all(job.finished for job in recent))
+
+
+@app.route('/<exam:exam>/jobs/<int:job_id>/')
+def job_status(exam, job_id):
+    job = exam.jobs.filter_by(id=job_id).first_or_404()
+    return jsonify(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        progress=job.progress,
+        total=job.total,
+        message=job.message,
+    )
+
+
 @app.route('/<exam:exam>/help/')
 def help(exam):
     return render_template('help.html.j2', exam=exam)
@@ -605,24 +1058,24 @@ class PhotosForm(FlaskForm):
 def new_photos(exam):
     form = PhotosForm()
     if form.validate_on_submit():
-        f = form.file.data
-        zf = zipfile.ZipFile(f, mode="r")
-        for name in zf.namelist():
-            print(name)
-            if name.endswith("/"):
-                continue
-            if name.count("/") > 1:
-                continue
-            match = re.search(r"([0-9]+)\.jpe?g", name)
-            if not match:
-                continue
-            sid = match.group(1)
-            path = os.path.join(app.config["PHOTO_DIRECTORY"], exam.offering, sid + ".jpg")
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, "wb+") as g:
-                g.write(zf.open(name, "r").read())
+        # Stage the upload where the job worker can find it
+        path = os.path.join(app.config["PHOTO_DIRECTORY"], ".uploads", uuid.uuid4().hex + ".zip")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        form.file.data.save(path)
+        jobs.enqueue(exam, 'photos', path=path)
+        return redirect(url_for('exam_jobs', exam=exam))
     return render_template('new_photos.html.j2', exam=exam, form=form)
 
+
+@jobs.handler('photos')
+def save_photos(job, exam, path):
+    try:
+        counts = photos.ingest(path, exam.offering)
+    finally:
+        os.remove(path)
+    return 'Saved {saved} photos, {unchanged} unchanged, {failed} failed, {skipped} other files skipped'.format(
+        **{key: counts[key] for key in ('saved', 'unchanged', 'failed', 'skipped')})
+
 class SeatForm(FlaskForm):
     new_room = SelectField('New Room')
     new_seat = StringField('New Seat', [InputRequired()])
@@ -652,6 +1105,16 @@ def reassign_seat(exam, email):
     return render_template('reassign_seat.html.j2', exam=exam, student=student, form=form)
 
 
+def room_students(room):
+    """Maps each occupied seat id in ROOM to its Student, in one query."""
+    return {
+        assignment.seat_id: assignment.student
+        for assignment in SeatAssignment.query.join(SeatAssignment.seat).filter(
+            Seat.room_id == room.id,
+        ).options(joinedload(SeatAssignment.student))
+    }
+
+
 @app.route('/<exam:exam>/rooms/<string:name>/')
 def room(exam, name):
     room = Room.query.filter_by(exam_id=exam.id, name=name).first_or_404()
@@ -659,14 +1122,45 @@ def room(exam, name):
     max_seatid = db.session.query(func.max(Seat.id)).filter_by(room_id=room.id)
     min_seatid = db.session.query(func.min(Seat.id)).filter_by(room_id=room.id)
     total = db.session.query(SeatAssignment).filter(SeatAssignment.seat_id<= max_seatid, SeatAssignment.seat_id>= min_seatid).count()
-    return render_template('room.html.j2', exam=exam, room=room, seat=seat, total=total)
+    students = room_students(room)
+    sprite = photos.room_sprite(room, {
+        seat_id: photos.original_path(exam.offering, student.bcourses_id)
+        for seat_id, student in students.items() if student.bcourses_id
+    })
+    return render_template('room.html.j2', exam=exam, room=room, seat=seat, total=total,
+                           students=students, sprite=sprite)
+
+
+@app.route('/<exam:exam>/rooms/<string:name>/photos/<string:version>.jpg')
+def room_photos(exam, name, version):
+    """Serves the sprite sheet of a room's photos. Sheets are named by the
+    seating they show, so they never change and can be cached for good."""
+    room = Room.query.filter_by(exam_id=exam.id, name=name).first_or_404()
+    if not re.fullmatch('[0-9a-f]{40}', version):
+        abort(404)
+    path = photos.sprite_path(room, version)
+    if not os.path.exists(path):
+        abort(404)
+    response = send_file(path, mimetype='image/jpeg', cache_timeout=365 * 24 * 60 * 60)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+def load_roster(exam):
+    """Loads every student of EXAM with their assignment, seat and room in
+    a single joined query, so rendering the roster doesn't lazy-load per row.
+    """
+    return Student.query.filter_by(exam_id=exam.id).options(
+        joinedload(Student.assignment)
+        .joinedload(SeatAssignment.seat)
+        .joinedload(Seat.room)
+    ).all()
 
 
 @app.route('/<exam:exam>/students/')
 def students(exam):
-    # TODO load assignment and seat at the same time?
-    students = Student.query.filter_by(exam_id=exam.id).all()
-    return render_template('students.html.j2', exam=exam, students=students, is_admin=is_admin())
+    return render_template('students.html.j2', exam=exam, students=load_roster(exam), is_admin=is_admin())
 
 
 @app.route('/<exam:exam>/students/<string:email>/')
@@ -685,7 +1179,95 @@ def photo(exam, email):
         return send_file(photo_path + ".jpg", mimetype='image/jpeg')
 
 
+@app.template_global()
+def photo_url(offering, bcourses_id):
+    if not bcourses_id:
+        return url_for('static', filename='img/photo-placeholder.png')
+    return url_for('thumbnail', token=photos.photo_token(offering, bcourses_id))
+
+
+@app.route('/photos/<token>.jpg')
+def thumbnail(token):
+    """Serves a seating chart thumbnail. The signed token, which expires
+    after PHOTO_URL_MAX_AGE seconds, is the only authorization, so this
+    needs no login or database lookup."""
+    photo = photos.photo_from_token(token)
+    if photo is None:
+        abort(404)
+    try:
+        path, digest = photos.thumbnail(photos.original_path(*photo))
+    except OSError:
+        abort(404)
+    response = send_file(path, mimetype='image/jpeg', add_etags=False,
+                         cache_timeout=app.config['PHOTO_CACHE_SECONDS'])
+    response.set_etag(digest)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+# The public chart for a room is the same for every seat except for which
+# one is highlighted, so each worker renders it once with a placeholder
+# where the seat name goes and fills it in per request.
+PublicChart = collections.namedtuple('PublicChart', [
+    'room_version', 'version', 'html', 'seats', 'rendered_at', 'checked_at',
+])
+
+# Room id -> PublicChart, whose seats map seat id -> seat name
+PUBLIC_CHARTS = {}
+# Seat id -> room id, for the seats of the charts in PUBLIC_CHARTS
+PUBLIC_SEATS = {}
+SEAT_PLACEHOLDER = 'seat-{}'.format(uuid.uuid4().hex)
+SELECTOR_PLACEHOLDER = 'selector-{}'.format(uuid.uuid4().hex)
+
+
+def css_string(value):
+    """Escapes VALUE to go inside a double-quoted string in a <style> element."""
+    return ''.join(c if c.isalnum() or c in '-_' else '\\{:x} '.format(ord(c)) for c in value)
+
+
+def drop_public_chart(room_id):
+    chart = PUBLIC_CHARTS.pop(room_id, None)
+    if chart:
+        for seat_id in chart.seats:
+            if PUBLIC_SEATS.get(seat_id) == room_id:
+                PUBLIC_SEATS.pop(seat_id, None)
+
+
+def public_chart(room):
+    chart = PUBLIC_CHARTS.get(room.id)
+    if chart is None or chart.room_version != room.version:
+        drop_public_chart(room.id)
+        layout = room.layout
+        html = render_template('seat.html.j2', room=room,
+                               seat_name=SEAT_PLACEHOLDER, seat_selector=SELECTOR_PLACEHOLDER)
+        seats = {seat.id: seat.name for row in layout.rows for seat in row}
+        chart = PublicChart(room.version, layout.version, html, seats, time.time(), time.time())
+        for seat_id in seats:
+            PUBLIC_SEATS[seat_id] = room.id
+    else:
+        chart = chart._replace(checked_at=time.time())
+    PUBLIC_CHARTS[room.id] = chart
+    return chart
+
+
 @app.route('/seat/<int:seat_id>/')
 def single_seat(seat_id):
-    seat = Seat.query.filter_by(id=seat_id).first_or_404()
-    return render_template('seat.html.j2', room=seat.room, seat=seat)
+    room_id = PUBLIC_SEATS.get(seat_id)
+    chart = PUBLIC_CHARTS.get(room_id)
+    if chart is None or seat_id not in chart.seats or \
+            time.time() - chart.checked_at > app.config['PUBLIC_CHART_TTL']:
+        # Reloading the room picks up its version, which changes whenever
+        # any worker changes its seats
+        seat = Seat.query.filter_by(id=seat_id).first()
+        if seat is None:
+            if room_id is not None:
+                drop_public_chart(room_id)
+            abort(404)
+        chart = public_chart(seat.room)
+    seat_name = chart.seats[seat_id]
+    html = chart.html.replace(SEAT_PLACEHOLDER, str(escape(seat_name)))
+    response = make_response(html.replace(SELECTOR_PLACEHOLDER, css_string(seat_name)))
+    response.set_etag('{}-{}'.format(chart.version, seat_id))
+    response.last_modified = chart.rendered_at
+    return response.make_conditional(request)
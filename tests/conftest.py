@@ -0,0 +1,69 @@
+import contextlib
+import os
+import threading
+
+# Never touch a real database: the tests create and drop every table
+os.environ.pop('FLASK_ENV', None)
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import pytest
+from sqlalchemy import event
+
+from server import app, views
+from server.models import ROOM_LAYOUTS, Exam, Room, Seat, SeatAssignment, Student, db
+
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        db.create_all()
+        yield db.session
+        db.session.remove()
+        db.drop_all()
+    # Ids are reused by the next test's database
+    ROOM_LAYOUTS.clear()
+    views.PUBLIC_CHARTS.clear()
+    views.PUBLIC_SEATS.clear()
+    views.EXAMS.clear()
+
+
+@contextlib.contextmanager
+def count_statements():
+    """Collects the SQL statements this thread runs inside the block,
+    executemany counting once. Job workers left running by earlier tests are
+    ignored."""
+    statements = []
+    thread = threading.current_thread()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is thread:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def make_exam(name, students, seats, rooms=1, assigned=0):
+    """Adds an exam with ROOMS rooms of SEATS seats each and STUDENTS students,
+    the first ASSIGNED of whom are seated."""
+    exam = Exam(offering='cal/cs61a/sp20', name=name, display_name=name, is_active=False)
+    db.session.add(exam)
+    db.session.flush()
+    all_seats = []
+    for r in range(rooms):
+        room = Room(exam_id=exam.id, name='room{}'.format(r), display_name='Room {}'.format(r))
+        for i in range(seats):
+            room.seats.append(Seat(name='A{}'.format(i), row='A', seat=str(i), x=i, y=0, attributes=set()))
+        db.session.add(room)
+        all_seats.extend(room.seats)
+    for i in range(students):
+        student = Student(exam_id=exam.id, email='student{}@berkeley.edu'.format(i), name='Student {}'.format(i),
+                          sid=str(i), bcourses_id=str(i), wants=set(), avoids=set())
+        db.session.add(student)
+        if i < assigned:
+            db.session.add(SeatAssignment(student=student, seat=all_seats[i]))
+    db.session.commit()
+    return exam
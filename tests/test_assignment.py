@@ -0,0 +1,80 @@
+import collections
+import random
+
+import pytest
+
+from server.assignment import (
+    AssignmentFailed, AssignmentInfeasible, assign, capped_seats, crowded_count, match, plan_rooms, spread,
+)
+
+Seat = collections.namedtuple('Seat', ['id', 'room_id', 'x', 'y', 'attributes'])
+Student = collections.namedtuple('Student', ['id', 'wants', 'avoids'])
+
+
+def seating(pairs):
+    return sorted((student.id, seat.id) for student, seat in pairs)
+
+
+def test_spread_seats_everyone_when_spacing_would_take_needed_seats():
+    seats = [Seat(i, 1, i, 0, set(attributes)) for i, attributes in
+             enumerate([['a', 'b'], ['b'], [], ['a', 'b'], [], ['a']])]
+    students = [Student(i, set(wants), set()) for i, wants in enumerate([['b'], ['a', 'b'], [], ['b'], ['a']])]
+    match(students, seats)
+    pairs = spread(students, seats, 2, rng=random.Random(0))
+    assert sorted(student.id for student, _ in pairs) == [0, 1, 2, 3, 4]
+    for student, seat in pairs:
+        assert student.wants <= seat.attributes
+
+
+def test_spread_leaves_gaps_when_there_is_room():
+    seats = [Seat(i, 1, i % 10, i // 10, set()) for i in range(100)]
+    students = [Student(i, set(), set()) for i in range(25)]
+    pairs = spread(students, seats, 2, rng=random.Random(0))
+    assert crowded_count([seat for _, seat in pairs], 2) == 0
+
+
+def test_plan_rooms_keeps_every_room_under_its_limit():
+    demand = {(frozenset(), frozenset()): 10}
+    rooms = {1: {frozenset(): 20}, 2: {frozenset(): 6}, 3: {frozenset(): 6}}
+    # Room 1 alone has room for everyone in total, but not within its limit
+    assert plan_rooms(demand, rooms, {1: 8, 2: 4, 3: 4}) == [1, 2]
+    assert plan_rooms(demand, rooms, {1: 4, 2: 2, 3: 2}) is None
+
+
+def test_capped_seats_respects_limits_and_keeps_needed_seats():
+    seats = [Seat(i, i // 10, i % 10, 0, {'lefty'} if i in (9, 19) else set()) for i in range(20)]
+    students = [Student(0, {'lefty'}, set()), Student(1, {'lefty'}, set())] + \
+        [Student(i, set(), set()) for i in range(2, 8)]
+    picked = capped_seats(students, seats, {0: 4, 1: 4})
+    assert collections.Counter(seat.room_id for seat in picked) == {0: 4, 1: 4}
+    assert {9, 19} <= {seat.id for seat in picked}
+    assert len(match(students, picked)) == 8
+
+
+def test_assign_is_repeatable_with_the_same_seed():
+    seats = [Seat(i, 1, i, 0, {'lefty'} if i % 3 == 0 else set()) for i in range(30)]
+    students = [Student(i, {'lefty'} if i < 5 else set(), set()) for i in range(20)]
+    first = assign(students, seats, rng=random.Random(7))
+    assert seating(first) == seating(assign(students, seats, rng=random.Random(7)))
+    assert seating(first) != seating(assign(students, seats, rng=random.Random(8)))
+    for student, seat in first:
+        assert student.wants <= seat.attributes
+
+
+def test_assign_reports_the_preference_that_runs_out():
+    seats = [Seat(i, 1, i, 0, {'lefty'} if i == 0 else set()) for i in range(5)]
+    students = [Student(i, {'lefty'}, set()) for i in range(2)]
+    with pytest.raises(AssignmentFailed) as e:
+        assign(students, seats, rng=random.Random(0))
+    assert e.value.preference == (frozenset({'lefty'}), frozenset())
+
+
+def test_match_reports_the_groups_that_cannot_share_their_seats():
+    seats = [Seat(i, 1, i, 0, {'lefty'} if i < 2 else set()) for i in range(10)]
+    students = [Student(i, {'lefty'}, set()) for i in range(3)] + \
+        [Student(i, set(), {'lefty'}) for i in range(3, 6)]
+    with pytest.raises(AssignmentInfeasible) as e:
+        match(students, seats)
+    # Only the lefties are short; everyone else fits
+    assert e.value.shortages == [((frozenset({'lefty'}), frozenset()), 3, 2)]
+    assert str(e.value) == 'Assignment failed! Not enough seats for: wants LEFTY (3 students, 2 seats)'
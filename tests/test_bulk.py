@@ -0,0 +1,35 @@
+from server import bulk
+from server.models import Room, SeatAssignment, Student
+
+from tests.conftest import count_statements, make_exam
+
+
+def delete_students_statements(name, emails):
+    exam = make_exam(name, students=len(emails), seats=len(emails), assigned=len(emails) // 2)
+    exam.id
+    with count_statements() as statements:
+        deleted, did_not_exist = bulk.delete_students(exam, emails + ['nobody@berkeley.edu'])
+    assert deleted == set(emails)
+    assert did_not_exist == {'nobody@berkeley.edu'}
+    assert Student.query.filter_by(exam_id=exam.id).count() == 0
+    return len(statements)
+
+
+def test_delete_students_statement_count_is_constant(session):
+    small = ['student{}@berkeley.edu'.format(i) for i in range(3)]
+    large = ['student{}@berkeley.edu'.format(i) for i in range(500)]
+    assert delete_students_statements('small', small) == delete_students_statements('large', large) == 3
+
+
+def delete_room_statements(name, seats):
+    exam = make_exam(name, students=seats, seats=seats, assigned=seats)
+    room = Room.query.filter_by(exam_id=exam.id).one()
+    with count_statements() as statements:
+        bulk.delete_room(room)
+    assert Room.query.filter_by(exam_id=exam.id).count() == 0
+    assert SeatAssignment.query.join(SeatAssignment.student).filter(Student.exam_id == exam.id).count() == 0
+    return len(statements)
+
+
+def test_delete_room_statement_count_is_constant(session):
+    assert delete_room_statements('small', 3) == delete_room_statements('large', 500) == 3
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from server.cache import TTLCache
+
+
+def test_cached_errors_are_raised_fresh():
+    def fetch(key):
+        raise ValueError(key)
+
+    cache = TTLCache(fetch, ttl=60, negative_ttl=60, stale=0, max_size=10)
+    with pytest.raises(ValueError) as first:
+        cache.get('x')
+    with pytest.raises(ValueError) as second:
+        cache.get('x')
+    assert first.value is not second.value
+    assert second.value.args == ('x',)
+    assert cache.errors == 1
+
+
+def test_no_stale_window_never_serves_expired_values():
+    answers = [True, False]
+    cache = TTLCache(lambda key: answers.pop(0), ttl=0.01, negative_ttl=0.01, stale=0, max_size=10)
+    assert cache.get('x') is True
+    time.sleep(0.02)
+    assert cache.get('x') is False
+
+
+def test_no_stale_window_does_not_fall_back_on_errors():
+    def fetch(key):
+        if calls:
+            raise ValueError(key)
+        calls.append(key)
+        return True
+
+    calls = []
+    cache = TTLCache(fetch, ttl=0.01, negative_ttl=60, stale=0, max_size=10)
+    assert cache.get('x') is True
+    time.sleep(0.02)
+    with pytest.raises(ValueError):
+        cache.get('x')
+
+
+def test_stale_window_closes_during_an_outage():
+    def fetch(key):
+        if calls:
+            raise ValueError(key)
+        calls.append(key)
+        return 'v1'
+
+    calls = []
+    cache = TTLCache(fetch, ttl=0.05, negative_ttl=0.01, stale=0.1, max_size=10)
+    assert cache.get('x') == 'v1'
+    deadline = time.time() + 0.12
+    while time.time() < deadline:
+        # Served stale while every background refresh fails
+        assert cache.get('x') == 'v1'
+        time.sleep(0.01)
+    time.sleep(0.05)
+    with pytest.raises(ValueError):
+        cache.get('x')
@@ -0,0 +1,14 @@
+from server import app
+
+from tests.conftest import make_exam
+
+
+def test_preview_assignment_runs_every_assign_mode(session):
+    exam = make_exam('final', students=3, seats=4, assigned=1)
+    # Each command ends its app context, which detaches EXAM
+    offering, name = exam.offering, exam.name
+    runner = app.test_cli_runner()
+    for mode in ('greedy', 'matching', 'incremental', 'spaced'):
+        result = runner.invoke(args=['previewassignment', offering, name, '--mode', mode])
+        assert result.exit_code == 0, result.output
+        assert '{} assignment: would seat 2 students'.format(mode) in result.output
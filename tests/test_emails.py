@@ -0,0 +1,96 @@
+import types
+
+import pytest
+
+from server import app, emails
+
+from tests.conftest import make_exam
+
+
+def test_batches_are_queried_as_they_are_sent(session):
+    exam = make_exam('final', students=5, seats=5, assigned=5)
+    seen = []
+    for batch in emails.batches(emails.pending_assignments(exam), size=2):
+        student_ids = [student_id for student_id, _ in batch]
+        seen.extend(student_ids)
+        # Marking a batch commits, which must not disturb the batches after it
+        emails.mark_emailed(student_ids)
+    assert seen == sorted(student.id for student in exam.students)
+    assert emails.progress(exam) == (5, 5)
+
+
+def test_email_students_marks_every_sent_batch(session, monkeypatch):
+    exam = make_exam('final', students=3, seats=3, assigned=3)
+    sent = []
+    monkeypatch.setattr(emails, 'send', sent.append)
+    message = {'from': {'email': 'staff@berkeley.edu'}, 'subject': 'Seats', 'additional_text': ''}
+    assert emails.email_students(exam, message, 'http://localhost') == 3
+    assert sum(len(data['personalizations']) for data in sent) == 3
+    assert emails.progress(exam) == (3, 3)
+
+
+class FakeSendGrid:
+    """Stands in for sendgrid.SendGridAPIClient, failing every request to
+    the addresses in FAILING and the first FLAKY requests of all."""
+
+    def __init__(self, failing=(), flaky=0):
+        self.failing = set(failing)
+        self.flaky = flaky
+        self.requests = []
+        self.client = types.SimpleNamespace(mail=types.SimpleNamespace(send=types.SimpleNamespace(post=self.post)))
+
+    def __call__(self, api_key, host):
+        return self
+
+    def post(self, request_body):
+        self.requests.append(request_body)
+        addresses = {to['email'] for p in request_body['personalizations'] for to in p['to']}
+        if self.flaky or addresses & self.failing:
+            self.flaky = max(self.flaky - 1, 0)
+            error = Exception('Internal Server Error')
+            error.status_code, error.body = 500, 'try again'
+            raise error
+        return types.SimpleNamespace(status_code=202, body='')
+
+
+@pytest.fixture
+def sendgrid(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(emails.time, 'sleep', sleeps.append)
+    monkeypatch.setitem(app.config, 'EMAIL_RETRIES', 2)
+    monkeypatch.setitem(app.config, 'EMAIL_BACKOFF', 1)
+    monkeypatch.setitem(app.config, 'EMAIL_WORKERS', 1)
+
+    def install(fake):
+        monkeypatch.setattr(emails.sendgrid, 'SendGridAPIClient', fake)
+        return fake, sleeps
+    return install
+
+
+def test_send_retries_with_exponential_backoff(sendgrid):
+    fake, sleeps = sendgrid(FakeSendGrid(flaky=2))
+    emails.send({'personalizations': []})
+    assert len(fake.requests) == 3
+    assert sleeps == [1, 2]
+
+
+def test_send_gives_up_after_its_retries(sendgrid):
+    fake, sleeps = sendgrid(FakeSendGrid(flaky=10))
+    with pytest.raises(emails.EmailError) as e:
+        emails.send({'personalizations': []})
+    assert 'Status: 500' in str(e.value)
+    assert len(fake.requests) == 3
+
+
+def test_a_failed_batch_does_not_stop_the_rest(session, sendgrid, monkeypatch):
+    exam = make_exam('final', students=3, seats=3, assigned=3)
+    monkeypatch.setattr(emails, 'BATCH_SIZE', 1)
+    fake, _ = sendgrid(FakeSendGrid(failing={'student1@berkeley.edu'}))
+    message = {'from': {'email': 'staff@berkeley.edu'}, 'subject': 'Seats', 'additional_text': ''}
+    with pytest.raises(emails.EmailError):
+        emails.email_students(exam, message, 'http://localhost')
+    # The failed batch was retried, the others went out and were marked
+    assert len(fake.requests) == 5
+    assert emails.progress(exam) == (2, 3)
+    emailed = {student.email for student in exam.students if student.assignment.emailed}
+    assert emailed == {'student0@berkeley.edu', 'student2@berkeley.edu'}
@@ -0,0 +1,33 @@
+import datetime
+
+from server import jobs
+from server.models import Job
+
+from tests.conftest import make_exam
+
+
+def add_job(session, exam, status, age):
+    job = Job(exam_id=exam.id, kind='test', args='{}', status=status,
+              updated_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=age))
+    session.add(job)
+    session.commit()
+    return job.id
+
+
+def test_claim_fails_jobs_abandoned_by_a_dead_worker(session):
+    exam = make_exam('final', students=0, seats=0)
+    abandoned = add_job(session, exam, 'running', age=3600)
+    alive = add_job(session, exam, 'running', age=1)
+    assert jobs.claim() is None
+    assert Job.query.get(abandoned).status == 'failed'
+    assert Job.query.get(alive).status == 'running'
+
+
+def test_run_records_the_handler_result(session, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'test', lambda job, exam: 'Tested {}'.format(exam.name))
+    exam = make_exam('final', students=0, seats=0)
+    add_job(session, exam, 'queued', age=0)
+    job = jobs.claim()
+    jobs.run(job)
+    job = Job.query.get(job.id)
+    assert (job.status, job.message) == ('done', 'Tested final')
@@ -0,0 +1,74 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from server import app, metrics, views
+from server.models import User
+
+from tests.conftest import count_statements, make_exam
+
+
+class Quiet:
+    def start(self, ctx):
+        pass
+
+    def finish(self, ctx):
+        pass
+
+
+def test_outbound_calls_are_labelled_with_their_endpoint(monkeypatch):
+    monkeypatch.setattr(app, 'instrumentation', Quiet())
+    monkeypatch.setattr(metrics, 'registry', metrics.Registry())
+    with app.test_request_context('/seat/1/'):
+        with metrics.outbound('auth'):
+            pass
+    with metrics.outbound('sendgrid'):
+        pass
+    exposition = metrics.registry.exposition()
+    assert 'seating_outbound_requests_total{endpoint="single_seat",service="auth"} 1' in exposition
+    assert 'seating_outbound_requests_total{endpoint="none",service="sendgrid"} 1' in exposition
+
+
+class Response:
+    def __init__(self, value):
+        self.value = value
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.value
+
+
+def test_requests_measure_their_url_converters(session, monkeypatch):
+    exam = make_exam('final', students=0, seats=0)
+    user = User(email='staff@berkeley.edu', offerings={exam.offering})
+    session.add(user)
+    session.commit()
+    monkeypatch.setattr(app, 'instrumentation', metrics.Instrumentation())
+    monkeypatch.setattr(metrics, 'registry', metrics.Registry())
+    monkeypatch.setitem(app.after_request_funcs, None,
+                        app.after_request_funcs.get(None, []) + [metrics.record_status])
+    monkeypatch.setattr(views.auth_session, 'post', lambda url, **kwargs: Response(
+        exam.offering if url.endswith('/get_endpoint') else 'cs61a'))
+    for cache in (views.DOMAIN_COURSES, views.COURSE_ENDPOINTS, views.ADMINS):
+        cache.invalidate()
+    views.EXAMS.clear()
+    event.listen(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    try:
+        client = app.test_client()
+        with client.session_transaction() as cookie:
+            cookie['_user_id'] = str(user.id)
+        help_url, offering_url = '/{}/{}/help/'.format(exam.offering, exam.name), '/{}/'.format(exam.offering)
+        with count_statements() as statements:
+            assert client.get(help_url).status_code == 200
+        assert client.get(offering_url).status_code == 200
+    finally:
+        event.remove(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    exposition = metrics.registry.exposition()
+    # The user and the exam are both loaded while matching the URL
+    assert len(statements) == 3
+    assert 'seating_sql_statements_total{{endpoint="help"}} {}'.format(len(statements)) in exposition
+    assert 'seating_outbound_requests_total{endpoint="offering",service="auth"}' in exposition
+    assert 'endpoint="unmatched"' not in exposition
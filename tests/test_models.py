@@ -0,0 +1,65 @@
+from server import bulk
+from server.models import ROOM_LAYOUTS, AttributeVocabulary, Exam, Room, Seat, Student
+
+from tests.conftest import make_exam
+
+
+def test_layout_is_rebuilt_after_another_worker_moves_a_seat(session):
+    exam = make_exam('final', students=0, seats=3)
+    room = Room.query.filter_by(exam_id=exam.id).one()
+    stale = room.layout
+    room.seats[0].x = 10
+    session.commit()
+    # Another worker still has the old layout cached
+    ROOM_LAYOUTS[room.id] = stale
+    assert room.layout is not stale
+    assert room.layout.version != stale.version
+
+
+def test_bulk_insert_gives_room_a_new_version(session):
+    exam = make_exam('final', students=0, seats=0)
+    room = Room.query.filter_by(exam_id=exam.id).one()
+    version = room.version
+    bulk.insert_seats(room.id, [bulk.SeatRow('A1', 'A', '1', 0, 0, set())], AttributeVocabulary(exam.id))
+    session.commit()
+    assert room.version != version
+
+
+def test_vocabulary_sees_bits_added_by_another_import(session):
+    exam = make_exam('final', students=0, seats=0)
+    first = AttributeVocabulary(exam.id)
+    second = AttributeVocabulary(exam.id)
+    assert second.encode(['front']) == 1
+    session.commit()
+    assert first.encode(['lefty']) == 2
+    assert first.encode(['front']) == 1
+    session.commit()
+
+
+def test_orm_writes_keep_masks_in_step(session):
+    exam = make_exam('final', students=1, seats=1)
+    seat = Room.query.filter_by(exam_id=exam.id).one().seats[0]
+    student = Student.query.filter_by(exam_id=exam.id).one()
+    seat.attributes = {'lefty', 'aisle'}
+    student.wants = {'lefty'}
+    student.avoids = {'aisle'}
+    session.commit()
+    vocabulary = AttributeVocabulary(exam.id)
+    assert vocabulary.decode(seat.attribute_mask) == {'lefty', 'aisle'}
+    assert vocabulary.decode(student.wants_mask) == {'lefty'}
+    assert vocabulary.decode(student.avoids_mask) == {'aisle'}
+
+
+def test_masks_are_derived_for_an_exam_added_in_the_same_flush(session):
+    exam = Exam(offering='cal/cs61a/sp20', name='final', display_name='Final', is_active=False)
+    room = Room(exam=exam, name='room', display_name='Room')
+    room.seats.append(Seat(name='A1', row='A', seat='1', x=0, y=0, attributes={'lefty', 'aisle'}))
+    student = Student(exam=exam, email='a@berkeley.edu', name='A', sid='1', bcourses_id='1',
+                      wants={'lefty'}, avoids={'broken'})
+    session.add_all([exam, room, student])
+    session.commit()
+    vocabulary = AttributeVocabulary(exam.id)
+    assert vocabulary.decode(room.seats[0].attribute_mask) == {'lefty', 'aisle'}
+    assert vocabulary.decode(student.wants_mask) == {'lefty'}
+    assert vocabulary.decode(student.avoids_mask) == {'broken'}
+    assert sorted(vocabulary.bits.values()) == [0, 1, 2]
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from server import app, photos
+from server.models import touch_rooms
+
+from tests.conftest import make_exam
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def photo_directory(tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, 'PHOTO_DIRECTORY', str(tmpdir))
+    monkeypatch.setattr(photos, 'ROOM_SPRITES', {})
+    return tmpdir
+
+
+def save_photo(directory, name):
+    path = str(directory.join(name + '.jpg'))
+    Image.new('RGB', (376, 500), 'gray').save(path, 'JPEG')
+    return path
+
+
+def test_room_sprite_is_scoped_to_the_room_and_its_version(session, photo_directory):
+    exam = make_exam('final', students=0, seats=2, rooms=2)
+    first, second = exam.rooms
+    photo = save_photo(photo_directory, '1')
+
+    sprite = photos.room_sprite(first, {first.seats[0].id: photo})
+    assert (sprite.width, sprite.height) == (94, 125)
+    path = photos.sprite_path(first, sprite.version)
+    assert os.path.dirname(path).endswith(os.path.join(str(exam.id), str(first.id)))
+    assert os.path.exists(path)
+    assert not os.path.exists(photos.sprite_path(second, sprite.version))
+
+    touch_rooms(session, [first.id])
+    session.commit()
+    assert photos.room_sprite(first, {first.seats[0].id: photo}).version != sprite.version
+
+
+def test_photo_tokens_expire(monkeypatch):
+    max_age = app.config['PHOTO_URL_MAX_AGE']
+    now = [1000000.0]
+    monkeypatch.setattr(photos.time, 'time', lambda: now[0])
+    token = photos.photo_token('cal/cs61a/sp20', '123')
+    assert photos.photo_token('cal/cs61a/sp20', '123') == token
+    now[0] += max_age // 2
+    assert photos.photo_from_token(token) == ('cal/cs61a/sp20', '123')
+    now[0] += max_age
+    assert photos.photo_from_token(token) is None
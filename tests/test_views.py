@@ -0,0 +1,147 @@
+import collections
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from server import app, bulk
+from server.models import Exam, Room, Seat, Student, touch_rooms
+from server.views import (
+    EXAMS, PUBLIC_CHARTS, PUBLIC_SEATS, AssignForm, ValidationError, assign_job, assign_preview, delete_exam,
+    drop_public_chart, find_exam, load_roster, toggle_exam,
+)
+
+from tests.conftest import count_statements, make_exam
+
+
+def roster_statements(session, name):
+    # Start from a session holding only the exam, as a request does
+    session.expunge_all()
+    exam = Exam.query.filter_by(name=name).one()
+    with count_statements() as statements:
+        for student in load_roster(exam):
+            if student.assignment:
+                student.assignment.seat.room.display_name
+    return len(statements)
+
+
+def test_load_roster_query_count_is_constant(session):
+    make_exam('small', students=5, seats=5, assigned=3)
+    make_exam('large', students=200, seats=100, rooms=2, assigned=150)
+    assert roster_statements(session, 'small') == roster_statements(session, 'large') == 1
+
+
+def test_public_chart_notices_changes_from_other_workers(session):
+    exam = make_exam('final', students=0, seats=3)
+    seat = Seat.query.join(Seat.room).filter(Room.exam_id == exam.id).first()
+    client = app.test_client()
+    assert client.get('/seat/{}/'.format(seat.id)).status_code == 200
+    # Another worker renames the seat; this one's chart has expired
+    session.execute(Seat.__table__.update().where(Seat.id == seat.id).values(name='Z9'))
+    touch_rooms(session, [seat.room_id])
+    session.commit()
+    PUBLIC_CHARTS[seat.room_id] = PUBLIC_CHARTS[seat.room_id]._replace(checked_at=0)
+    assert 'Z9' in client.get('/seat/{}/'.format(seat.id)).get_data(as_text=True)
+
+
+def test_public_chart_escapes_seat_name_in_css(session):
+    exam = make_exam('final', students=0, seats=1)
+    seat = Seat.query.join(Seat.room).filter(Room.exam_id == exam.id).one()
+    seat.name = 'A"]</style><b>'
+    session.commit()
+    html = app.test_client().get('/seat/{}/'.format(seat.id)).get_data(as_text=True)
+    assert '<title>Room 0 A&#34;]&lt;/style&gt;&lt;b&gt;</title>' in html
+    assert '.seat[id="A\\22 \\5d \\3c \\2f style\\3e \\3c b\\3e "]' in html
+
+
+def test_deleting_a_room_drops_its_public_seats(session):
+    exam = make_exam('final', students=0, seats=5)
+    room = Room.query.filter_by(exam_id=exam.id).one()
+    seat_ids = [seat.id for seat in room.seats]
+    client = app.test_client()
+    client.get('/seat/{}/'.format(seat_ids[0]))
+    assert set(seat_ids) <= set(PUBLIC_SEATS)
+    drop_public_chart(room.id)
+    bulk.delete_room(room)
+    assert not set(seat_ids) & set(PUBLIC_SEATS)
+    assert client.get('/seat/{}/'.format(seat_ids[0])).status_code == 404
+
+
+def test_assign_form_allows_blank_spacing(session, monkeypatch):
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    with app.test_request_context(method='POST', data={'mode': 'matching', 'spacing': '', 'utilization': ''}):
+        form = AssignForm()
+        assert form.validate()
+        assert form.spacing.data is None
+
+
+def test_assign_with_utilization_caps_every_room(session):
+    exam = make_exam('final', students=10, seats=10, rooms=3)
+    assign_job(None, exam, 'matching', utilization='0.5')
+    per_room = collections.Counter(
+        room_id for room_id, in session.query(Seat.room_id).join(Seat.assignment)
+    )
+    assert sum(per_room.values()) == 10
+    assert max(per_room.values()) <= 5
+
+
+def test_incremental_assignment_rejects_utilization(session):
+    exam = make_exam('final', students=2, seats=10)
+    with pytest.raises(ValidationError):
+        assign_job(None, exam, 'incremental', utilization='0.8')
+
+
+def test_incremental_assignment_moves_only_whom_it_must(session):
+    exam = make_exam('final', students=10, seats=10, assigned=8)
+    room = exam.rooms[0]
+    for seat in room.seats[:2]:
+        seat.attributes = {'left'}
+    newcomers = [student for student in exam.students if not student.assignment]
+    for student in newcomers:
+        student.wants = {'left'}
+    session.commit()
+    seated = {student.id: student.assignment.seat_id for student in exam.students if student.assignment}
+
+    assert assign_job(None, exam, 'incremental') == 'Assigned 4 students, 2 of whom moved seats'
+    session.expire_all()
+    for student in exam.students:
+        assert student.wants <= student.assignment.seat.attributes
+    unmoved = [id for id, seat_id in seated.items() if Student.query.get(id).assignment.seat_id == seat_id]
+    assert len(unmoved) == 6
+
+
+def test_assign_preview_rejects_unknown_modes(session):
+    exam = make_exam('final', students=2, seats=4, assigned=1)
+    with app.test_request_context('/?mode=fastest'):
+        with pytest.raises(BadRequest):
+            assign_preview(exam)
+    with app.test_request_context('/?mode=incremental'):
+        run = assign_preview(exam).get_json()['run']
+    assert (run['assigned'], run['error']) == (1, None)
+
+
+
+def test_toggling_an_exam_uses_its_current_state(session):
+    exam = make_exam('final', students=0, seats=0)
+    key, exam_id = (exam.offering, exam.name), exam.id
+    find_exam(*key)
+    # Another worker activates the exam after this one cached it
+    Exam.query.filter_by(id=exam_id).update({'is_active': True})
+    session.commit()
+    session.expunge_all()
+    with app.test_request_context('/'):
+        stale = find_exam(*key)
+        assert stale.is_active is False
+        toggle_exam(stale)
+    assert Exam.query.get(exam_id).is_active is False
+
+
+def test_deleting_an_already_deleted_exam_redirects(session):
+    exam = make_exam('final', students=0, seats=0)
+    key, exam_id = (exam.offering, exam.name), exam.id
+    find_exam(*key)
+    Exam.query.filter_by(id=exam_id).delete()
+    session.commit()
+    session.expunge_all()
+    with app.test_request_context('/'):
+        assert delete_exam(find_exam(*key)).status_code == 302
+    assert key not in EXAMS